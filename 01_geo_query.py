@@ -7,11 +7,20 @@ Queries Gene Expression Omnibus for bulk RNA-seq studies across multiple cancer
 import requests
 import pandas as pd
 import json
-import xml.etree.ElementTree as ET
+import re
+import functools
+# libxml2-backed parsing with one reusable parser that skips whitespace-only
+# text nodes, the xml:id index and entity expansion
+try:
+    from lxml import etree as ET
+    _XML_PARSER = ET.XMLParser(remove_blank_text=True, resolve_entities=False,
+                               collect_ids=False, huge_tree=False)
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _XML_PARSER = None
 from datetime import datetime
 import logging
-from typing import List, Dict, Tuple, Optional
-import time
+from typing import List, Dict, Tuple, Optional, Callable
 import sys
 from pathlib import Path
 
@@ -20,6 +29,8 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 try:
     import config
+    from http_utils import TokenBucket, build_eutils_session, HTTP_ERRORS as NCBI_HTTP_ERRORS
+    from ncbi_utils import NCBIQueryEngine
     from utils import (
         retry_with_backoff, setup_logger, validate_csv_structure,
         consolidate_dataframes, safe_divide
@@ -32,10 +43,57 @@ except ImportError as e:
 # Configure logging
 logger = setup_logger(__name__, log_file=str(config.LOG_DIR / "geo_query.log"), level=config.LOG_LEVEL)
 
+# Single-cell exclusion keywords compiled once; IGNORECASE replaces lower-casing every title
+_EXCLUDE_RE = re.compile('|'.join(map(re.escape, config.EXCLUDED_KEYWORDS)), re.IGNORECASE)
+# Same keywords as esearch NOT clauses, so most single-cell hits never get a metadata fetch;
+# _EXCLUDE_RE stays as the client-side safety net
+_EXCLUDE_QUERY = ' '.join(f'NOT "{keyword}"[Title]' for keyword in config.EXCLUDED_KEYWORDS)
+
+
+# Native multithreaded CSV writer for large result tables
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+
+# One bucket per process, shared by every engine instance and worker thread
+NCBI_RATE_LIMITER = TokenBucket(config.NCBI_REQUESTS_PER_SECOND, config.NCBI_RATE_BURST)
+
+
+def _parse_sample_count(text: str, gse_id: str) -> int:
+    """n_samples Item text as an int (0 when missing or malformed)"""
+    try:
+        return int(text) if text else 0
+    except (ValueError, TypeError):
+        return 0
 
-class GEOQueryEngine:
+
+# esummary Item Name -> (metadata key, converter taking the Item text and dataset ID)
+_GEO_ITEM_HANDLERS: Dict[str, Tuple[str, Callable[[str, str], object]]] = {
+    'Accession': ('gse_id', lambda text, gse_id: text or gse_id),
+    'title': ('title', lambda text, gse_id: text or 'Unknown'),
+    'summary': ('summary', lambda text, gse_id: text),
+    'taxon': ('organism', lambda text, gse_id: text or 'Homo sapiens'),
+    'n_samples': ('sample_count', _parse_sample_count),
+    'GPL': ('platform', lambda text, gse_id: text),
+    'PlatformTitle': ('platform', lambda text, gse_id: text),
+    'PDAT': ('submission_date', lambda text, gse_id: text),  # Publication date
+    'updatedate': ('last_update', lambda text, gse_id: text),
+}
+
+
+class GEOQueryEngine(NCBIQueryEngine):
     """Query GEO database for bulk RNA-seq cancer datasets"""
     
+    # Record noun in the shared log messages and default results file under DATA_DIR
+    RECORD_NAME = 'dataset'
+    OUTPUT_FILE = 'geo_datasets.csv'
+    # Output columns, in the order _parse_docsum fills them
+    METADATA_KEYS = ('gse_id', 'title', 'summary', 'organism', 'sample_count',
+                     'platform', 'submission_date', 'last_update', 'cancer_type')
+    
     def __init__(self):
         """Initialize GEO query engine with validated credentials"""
         self.base_url = "https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi"
@@ -48,11 +106,35 @@ class GEOQueryEngine:
         self.timeout = config.API_TIMEOUT
         self.max_retries = config.API_RETRIES
         self.datasets = []
+        self.session = self._build_session()
+        super().__init__(config.DATA_DIR / "geo_metadata_cache.pkl", logger)
         
         logger.info(f"GEO Query Engine initialized (timeout={self.timeout}s, retries={self.max_retries})")
+    
+    def _build_session(self):
+        """Build a keep-alive session for eutils; retries stay with @retry_with_backoff"""
+        return build_eutils_session(
+            self.email, self.api_key, self.timeout, NCBI_RATE_LIMITER.acquire,
+            cache_name=str(config.DATA_DIR / 'ncbi_cache'),
+            expire_seconds=config.NCBI_CACHE_EXPIRE_SECONDS,
+            http2=config.NCBI_HTTP2,
+            max_connections=config.NCBI_MAX_CONCURRENCY
+        )
+    
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
         
-    def build_search_query(self, cancer_type: str) -> str:
-        """Build GEO search query for specific cancer type"""
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def build_search_query(cancer_type: str) -> str:
+        """Build GEO search query for specific cancer type (pure, cached per cancer type)"""
         # Use search terms from config
         query = config.GEO_SEARCH_TERMS.get(cancer_type)
         if not query:
@@ -60,9 +142,13 @@ class GEOQueryEngine:
                 f"Unknown cancer type: {cancer_type}. "
                 f"Supported types: {list(config.GEO_SEARCH_TERMS.keys())}"
             )
-        return query
+        return f"({query}) {_EXCLUDE_QUERY}"
     
-    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=(requests.RequestException,))
+    def _search_ids(self, cancer_type: str, max_results: int) -> List[str]:
+        """search_geo as called by NCBIQueryEngine.iter_cancer_results"""
+        return self.search_geo(cancer_type, max_results=max_results)
+    
+    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=NCBI_HTTP_ERRORS)
     def search_geo(self, cancer_type: str, max_results: int = 100) -> List[str]:
         """
         Search GEO for datasets matching cancer type.
@@ -81,14 +167,10 @@ class GEOQueryEngine:
             'db': 'gds',
             'term': query,
             'retmax': max_results,
-            'rettype': 'json',  # NCBI returns XML regardless, so we parse XML
-            'email': self.email
+            'rettype': 'json'  # NCBI returns XML regardless, so we parse XML
         }
         
-        if self.api_key:
-            params['api_key'] = self.api_key
-        
-        response = requests.get(self.search_url, params=params, timeout=self.timeout)
+        response = self.session.get(self.search_url, params=params, timeout=self.timeout)
         response.raise_for_status()
         
         # Check HTTP status and rate limiting
@@ -97,13 +179,13 @@ class GEOQueryEngine:
             raise requests.RequestException("Rate limited (429)")
         
         # Validate response has content
-        if not response.text or not response.text.strip():
+        if not response.content or not response.content.strip():
             logger.warning(f"Empty response from GEO search for {cancer_type}")
             raise requests.RequestException(f"Empty response from API")
         
         try:
             # NCBI returns XML, not JSON, despite rettype=json parameter
-            root = ET.fromstring(response.text)
+            root = ET.fromstring(response.content, _XML_PARSER)
             
             # Parse XML to extract ID list
             id_list = root.find('.//IdList')
@@ -117,14 +199,37 @@ class GEOQueryEngine:
             
         except ET.ParseError as e:
             logger.error(f"Failed to parse XML response: {e}")
-            logger.debug(f"Response content: {response.text[:500]}")
+            logger.debug(f"Response content: {response.content[:500].decode('utf-8', 'replace')}")
             raise requests.RequestException(f"Invalid XML response: {e}")
         except (ValueError, AttributeError, TypeError) as e:
             logger.error(f"Error extracting IDs from response: {e}")
-            logger.debug(f"Response content: {response.text[:500]}")
+            logger.debug(f"Response content: {response.content[:500].decode('utf-8', 'replace')}")
             raise requests.RequestException(f"Error parsing XML: {e}")
     
-    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=(requests.RequestException,))
+    def _parse_docsum(self, docsum: ET.Element, gse_id: str) -> Dict:
+        """Build the metadata dict for one esummary DocSum element"""
+        # Initialize metadata with defaults
+        metadata = {
+            'gse_id': gse_id,
+            'title': 'Unknown',
+            'summary': '',
+            'organism': 'Homo sapiens',
+            'sample_count': 0,
+            'platform': '',
+            'submission_date': '',
+            'last_update': '',
+        }
+        
+        # Extract data from Item elements, one dict lookup per Item
+        for item in docsum.findall('Item'):
+            handler = _GEO_ITEM_HANDLERS.get(item.get('Name', ''))
+            if handler is not None:
+                key, convert = handler
+                metadata[key] = convert(item.text or '', gse_id)
+        
+        return metadata
+    
+    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=NCBI_HTTP_ERRORS)
     def fetch_dataset_metadata(self, gse_id: str) -> Optional[Dict]:
         """
         Fetch detailed metadata for a GEO dataset using NCBI esummary API.
@@ -136,20 +241,20 @@ class GEOQueryEngine:
         Returns:
             Metadata dictionary or None if fetch fails
         """
+        cached = self._metadata_cache.get(gse_id)
+        if cached is not None:
+            return cached
+        
         logger.debug(f"Fetching metadata for {gse_id}...")
         
         # Use esummary API which returns structured XML with metadata
         url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
         params = {
             'db': 'gds',
-            'id': gse_id,
-            'email': self.email
+            'id': gse_id
         }
         
-        if self.api_key:
-            params['api_key'] = self.api_key
-        
-        response = requests.get(url, params=params, timeout=self.timeout)
+        response = self.session.get(url, params=params, timeout=self.timeout)
         response.raise_for_status()
         
         # Check rate limiting (HTTP 429)
@@ -158,25 +263,13 @@ class GEOQueryEngine:
             raise requests.RequestException("Rate limited (429)")
         
         # Validate response has content
-        if not response.text or not response.text.strip():
+        if not response.content or not response.content.strip():
             logger.warning(f"Empty response from NCBI esummary for {gse_id}")
             return None
         
         try:
             # Parse XML response from esummary
-            root = ET.fromstring(response.text)
-            
-            # Initialize metadata with defaults
-            metadata = {
-                'gse_id': gse_id,
-                'title': 'Unknown',
-                'summary': '',
-                'organism': 'Homo sapiens',
-                'sample_count': 0,
-                'platform': '',
-                'submission_date': '',
-                'last_update': '',
-            }
+            root = ET.fromstring(response.content, _XML_PARSER)
             
             # Find the DocSum element which contains the dataset information
             docsum = root.find('.//DocSum')
@@ -184,42 +277,79 @@ class GEOQueryEngine:
                 logger.warning(f"No DocSum found in esummary response for {gse_id}")
                 return None
             
-            # Extract data from Item elements
-            for item in docsum.findall('Item'):
-                name = item.get('Name', '')
-                text = item.text or ''
-                
-                if name == 'Accession':
-                    metadata['gse_id'] = text or gse_id
-                elif name == 'title':
-                    metadata['title'] = text or 'Unknown'
-                elif name == 'summary':
-                    metadata['summary'] = text or ''
-                elif name == 'taxon':
-                    metadata['organism'] = text or 'Homo sapiens'
-                elif name == 'n_samples':
-                    try:
-                        metadata['sample_count'] = int(text) if text else 0
-                    except (ValueError, TypeError):
-                        metadata['sample_count'] = 0
-                elif name == 'GPL' or name == 'PlatformTitle':
-                    metadata['platform'] = text or ''
-                elif name == 'PDAT':  # Publication date
-                    metadata['submission_date'] = text or ''
-                elif name == 'updatedate':
-                    metadata['last_update'] = text or ''
+            metadata = self._parse_docsum(docsum, gse_id)
             
             logger.debug(f"Successfully extracted metadata for {gse_id}: {metadata['title'][:80]}")
+            self._metadata_cache[gse_id] = metadata
             return metadata
             
         except ET.ParseError as e:
             logger.error(f"Failed to parse XML for {gse_id}: {e}")
-            logger.debug(f"Response content: {response.text[:500]}")
+            logger.debug(f"Response content: {response.content[:500].decode('utf-8', 'replace')}")
             raise requests.RequestException(f"Invalid XML response: {e}")
         except (KeyError, TypeError, AttributeError) as e:
             logger.error(f"Error extracting metadata for {gse_id}: {e}")
             return None
     
+    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=NCBI_HTTP_ERRORS)
+    def fetch_dataset_metadata_batch(self, gse_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Fetch metadata for many GEO datasets with a single esummary request.
+        
+        Args:
+            gse_ids: GEO dataset IDs (numerical IDs from search results)
+        
+        Returns:
+            Metadata dictionaries keyed by dataset ID; IDs without a DocSum are absent
+        """
+        logger.debug(f"Fetching metadata for {len(gse_ids)} datasets...")
+        
+        # POST keeps long ID lists out of the URL
+        url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+        data = {
+            'db': 'gds',
+            'id': ','.join(gse_ids)
+        }
+        
+        response = self.session.post(url, data=data, timeout=self.timeout)
+        response.raise_for_status()
+        
+        if not response.content or not response.content.strip():
+            logger.warning(f"Empty response from NCBI esummary for {len(gse_ids)} datasets")
+            return {}
+        
+        try:
+            root = ET.fromstring(response.content, _XML_PARSER)
+        except ET.ParseError as e:
+            logger.error(f"Failed to parse esummary XML batch: {e}")
+            logger.debug(f"Response content: {response.content[:500].decode('utf-8', 'replace')}")
+            raise requests.RequestException(f"Invalid XML response: {e}")
+        
+        results = {}
+        for docsum in root.iter('DocSum'):
+            gse_id = docsum.findtext('Id', default='')
+            try:
+                results[gse_id] = self._parse_docsum(docsum, gse_id)
+            except (KeyError, TypeError, AttributeError) as e:
+                logger.error(f"Error extracting metadata for {gse_id}: {e}")
+        return results
+    
+    def _fetch_batch_safe(self, gse_ids: List[str]) -> List[Optional[Dict]]:
+        """fetch_dataset_metadata_batch for worker threads: results in input order, None on failure"""
+        try:
+            results = self.fetch_dataset_metadata_batch(gse_ids)
+        except NCBI_HTTP_ERRORS as e:
+            logger.warning(f"Failed to fetch metadata for batch of {len(gse_ids)}: {e}")
+            return [None] * len(gse_ids)
+        except Exception as e:
+            logger.error(f"Unexpected error fetching batch of {len(gse_ids)}: {e}")
+            return [None] * len(gse_ids)
+        
+        for gse_id in gse_ids:
+            if gse_id not in results:
+                logger.debug(f"Skipped {gse_id} - no metadata returned")
+        return [results.get(gse_id) for gse_id in gse_ids]
+    
     def query_all_cancers(self, max_results_per_cancer: int = 50) -> pd.DataFrame:
         """
         Query all cancer types and compile results.
@@ -230,50 +360,12 @@ class GEOQueryEngine:
         Returns:
             DataFrame with all retrieved datasets
         """
-        cancer_types = list(config.CANCER_TYPES.keys())  # Use cancer types from config
-        all_datasets = []
-        failed_queries = []
-        
-        for cancer_type in cancer_types:
-            try:
-                gse_ids = self.search_geo(cancer_type, max_results=max_results_per_cancer)
-                logger.info(f"Processing {len(gse_ids)} results for {cancer_type}")
-                
-                for gse_id in gse_ids:
-                    try:
-                        metadata = self.fetch_dataset_metadata(gse_id)
-                        if metadata is not None:
-                            metadata['cancer_type'] = cancer_type
-                            all_datasets.append(metadata)
-                        else:
-                            logger.debug(f"Skipped {gse_id} - no metadata returned")
-                    except requests.RequestException as e:
-                        logger.warning(f"Failed to fetch metadata for {gse_id}: {e}")
-                        continue
-                    except Exception as e:
-                        logger.error(f"Unexpected error fetching {gse_id}: {e}")
-                        continue
-                    
-                    # Rate limiting - respectful delay between requests
-                    time.sleep(0.4)
-                    
-            except requests.RequestException as e:
-                logger.error(f"Failed to query cancer type {cancer_type}: {e}")
-                failed_queries.append((cancer_type, str(e)))
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error querying {cancer_type}: {e}")
-                failed_queries.append((cancer_type, str(e)))
-                continue
-        
-        if failed_queries:
-            logger.warning(f"Failed to query {len(failed_queries)} cancer types: {failed_queries}")
-        
-        if not all_datasets:
+        frames = [df for _, df in self.iter_cancer_results(max_results_per_cancer)]
+        if not frames:
             logger.warning("No datasets retrieved from GEO")
             return pd.DataFrame()
         
-        df = pd.DataFrame(all_datasets)
+        df = pd.concat(frames, ignore_index=True)
         logger.info(f"Total datasets retrieved: {len(df)}")
         return df
     
@@ -292,7 +384,7 @@ class GEOQueryEngine:
             return df
         
         # Filter out single-cell studies using keywords from config
-        mask = ~df['title'].str.lower().str.contains('|'.join(config.EXCLUDED_KEYWORDS), na=False)
+        mask = ~df['title'].str.contains(_EXCLUDE_RE, na=False)
         filtered_df = df[mask].copy()
         
         n_removed = len(df) - len(filtered_df)
@@ -315,11 +407,21 @@ class GEOQueryEngine:
             return ""
         
         if output_file is None:
-            output_file = str(config.DATA_DIR / "geo_datasets.csv")
+            output_file = str(config.DATA_DIR / self.OUTPUT_FILE)
         
         try:
             Path(output_file).parent.mkdir(parents=True, exist_ok=True)
-            df.to_csv(output_file, index=False)
+            written = False
+            if pacsv is not None:
+                try:
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    pacsv.write_csv(table, output_file, write_options=pacsv.WriteOptions(include_header=True))
+                    written = True
+                except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                    # Mixed-type object columns; let pandas stringify them
+                    logger.debug(f"Arrow CSV writer rejected table, using pandas: {e}")
+            if not written:
+                df.to_csv(output_file, index=False)
             logger.info(f"Results saved to {output_file} ({len(df)} datasets)")
             return output_file
         except IOError as e:
@@ -334,30 +436,24 @@ def main():
         logger.info("Starting GEO database query...")
         logger.info("=" * 60)
         
-        engine = GEOQueryEngine()
-        
-        # Query all cancer types
-        results_df = engine.query_all_cancers(max_results_per_cancer=config.MAX_GEO_RECORDS)
-        
-        if results_df.empty:
-            logger.error("No datasets retrieved from GEO query")
-            return None
-        
-        # Filter for bulk RNA-seq
-        bulk_rnaseq_df = engine.filter_bulk_rnaseq(results_df)
-        
-        if bulk_rnaseq_df.empty:
-            logger.error("All datasets filtered out - no bulk RNA-seq data found")
-            return None
-        
-        # Save results
-        output_file = engine.save_results(bulk_rnaseq_df)
-        
-        logger.info("=" * 60)
-        logger.info(f"GEO query complete. Found {len(bulk_rnaseq_df)} bulk RNA-seq datasets")
-        logger.info("=" * 60)
-        
-        return bulk_rnaseq_df
+        with GEOQueryEngine() as engine:
+            engine.load_metadata_cache()
+            try:
+                # Query, filter for bulk RNA-seq and save one cancer type at a time
+                bulk_rnaseq_df = engine.stream_results(max_results_per_cancer=config.MAX_GEO_RECORDS)
+            finally:
+                # Checkpoint even after a failure so the rerun skips metadata already fetched
+                engine.save_metadata_cache()
+            
+            if bulk_rnaseq_df.empty:
+                logger.error("No bulk RNA-seq datasets retrieved from GEO query")
+                return None
+            
+            logger.info("=" * 60)
+            logger.info(f"GEO query complete. Found {len(bulk_rnaseq_df)} bulk RNA-seq datasets")
+            logger.info("=" * 60)
+            
+            return bulk_rnaseq_df
     
     except Exception as e:
         logger.error(f"Fatal error during GEO query: {e}", exc_info=True)
@@ -6,11 +6,22 @@ Queries NCBI Sequence Read Archive for RNA-seq experiments across cancer types
 
 import requests
 import pandas as pd
-import xml.etree.ElementTree as ET
+import numpy as np
+# libxml2-backed parsing is several times faster on large efetch responses;
+# skip whitespace-only text nodes, the xml:id index and entity expansion
+try:
+    from lxml import etree as ET
+    _ITERPARSE_OPTIONS = dict(remove_blank_text=True, resolve_entities=False,
+                              collect_ids=False, huge_tree=False)
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _ITERPARSE_OPTIONS = {}
 import json
+import re
+import functools
+import io
 from typing import List, Dict, Optional
 import logging
-import time
 import sys
 from pathlib import Path
 
@@ -19,6 +30,8 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 try:
     import config
+    from http_utils import TokenBucket, build_eutils_session, HTTP_ERRORS as NCBI_HTTP_ERRORS
+    from ncbi_utils import NCBIQueryEngine
     from utils import (
         retry_with_backoff, setup_logger, validate_accession_format,
         safe_divide, verify_dependencies
@@ -29,25 +42,83 @@ except ImportError as e:
 
 logger = setup_logger(__name__, log_file=str(config.LOG_DIR / "sra_query.log"), level=config.LOG_LEVEL)
 
+# Single-cell exclusion keywords compiled once; IGNORECASE replaces lower-casing every title
+_EXCLUDE_RE = re.compile('|'.join(map(re.escape, config.EXCLUDED_KEYWORDS)), re.IGNORECASE)
+# Same keywords as esearch NOT clauses, so most single-cell hits never get a metadata fetch;
+# _EXCLUDE_RE stays as the client-side safety net
+_EXCLUDE_QUERY = ' '.join(f'NOT "{keyword}"[Title]' for keyword in config.EXCLUDED_KEYWORDS)
+# EXPERIMENT accession inside an esummary ExpXml item
+_EXPERIMENT_ACC_RE = re.compile(r'<Experiment\s[^>]*?\bacc="([^"]+)"')
+
+
+# Native multithreaded CSV writer for large result tables
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+
+# One bucket per process, shared by every engine instance and worker thread
+NCBI_RATE_LIMITER = TokenBucket(config.NCBI_REQUESTS_PER_SECOND, config.NCBI_RATE_BURST)
 
-class SRAQueryEngine:
+
+class SRAQueryEngine(NCBIQueryEngine):
     """Query SRA database for bulk RNA-seq cancer datasets"""
     
+    # Record noun in the shared log messages and default results file under DATA_DIR
+    RECORD_NAME = 'experiment'
+    OUTPUT_FILE = 'sra_experiments.csv'
+    SUMMARY_COLUMNS = ('cancer_type', 'platform')
+    # Output columns, in the order _new_metadata fills them
+    METADATA_KEYS = ('sra_id', 'experiment_accession', 'run_accession', 'sample_accession',
+                     'study_accession', 'title', 'organism', 'library_strategy', 'library_source',
+                     'library_selection', 'platform', 'instrument_model', 'read_length',
+                     'base_count', 'run_count', 'submission_date', 'publication_date', 'cancer_type')
+    # Raw RUN attributes, turned into base_count/read_length by _add_read_metrics
+    RAW_RUN_KEYS = ('total_bases', 'total_spots')
+    EXTRA_KEYS = RAW_RUN_KEYS
+    
     def __init__(self):
         """Initialize SRA query engine with validated credentials"""
         self.search_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
         self.fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+        self.summary_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
         self.email = config.NCBI_EMAIL
         self.api_key = config.NCBI_API_KEY
         self.timeout = config.API_TIMEOUT
         self.max_retries = config.API_RETRIES
         self.datasets = []
+        self.session = self._build_session()
+        super().__init__(config.DATA_DIR / "sra_metadata_cache.pkl", logger)
         
         logger.info(f"SRA Query Engine initialized (timeout={self.timeout}s, retries={self.max_retries})")
     
-    def build_sra_query(self, cancer_type: str) -> str:
+    def _build_session(self):
+        """Build a keep-alive session for eutils; retries stay with @retry_with_backoff"""
+        return build_eutils_session(
+            self.email, self.api_key, self.timeout, NCBI_RATE_LIMITER.acquire,
+            cache_name=str(config.DATA_DIR / 'ncbi_cache'),
+            expire_seconds=config.NCBI_CACHE_EXPIRE_SECONDS,
+            http2=config.NCBI_HTTP2,
+            max_connections=config.NCBI_MAX_CONCURRENCY
+        )
+    
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def build_sra_query(cancer_type: str) -> str:
         """
-        Build SRA search query for specific cancer type.
+        Build SRA search query for specific cancer type (pure, cached per cancer type).
         
         Args:
             cancer_type: Type of cancer to search for
@@ -62,9 +133,13 @@ class SRAQueryEngine:
                 f"Unknown cancer type: {cancer_type}. "
                 f"Supported types: {list(config.SRA_SEARCH_TERMS.keys())}"
             )
-        return query
+        return f"({query}) {_EXCLUDE_QUERY}"
     
-    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=(requests.RequestException,))
+    def _search_ids(self, cancer_type: str, max_results: int) -> List[str]:
+        """search_sra as called by NCBIQueryEngine.iter_cancer_results"""
+        return self.search_sra(cancer_type, max_results=max_results)
+    
+    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=NCBI_HTTP_ERRORS)
     def search_sra(self, cancer_type: str, max_results: int = 1000) -> List[str]:
         """
         Search SRA for experiments matching cancer type.
@@ -84,18 +159,14 @@ class SRAQueryEngine:
             'term': query,
             'retmax': max_results,
             'rettype': 'json',
-            'retmode': 'json',
-            'email': self.email
+            'retmode': 'json'
         }
         
-        if self.api_key:
-            params['api_key'] = self.api_key
-        
-        response = requests.get(self.search_url, params=params, timeout=self.timeout)
+        response = self.session.get(self.search_url, params=params, timeout=self.timeout)
         response.raise_for_status()
         
         # Validate response has content
-        if not response.text or not response.text.strip():
+        if not response.content or not response.content.strip():
             logger.warning(f"Empty response from SRA search for {cancer_type}")
             raise requests.RequestException(f"Empty response from API")
         
@@ -103,7 +174,7 @@ class SRAQueryEngine:
             data = response.json()
         except (ValueError, json.JSONDecodeError) as e:
             logger.error(f"Error parsing JSON response: {e}")
-            logger.error(f"Response content: {response.text[:200]}")
+            logger.error(f"Response content: {response.content[:200].decode('utf-8', 'replace')}")
             raise requests.RequestException(f"Invalid JSON response: {e}")
         
         if not data or 'esearchresult' not in data:
@@ -118,7 +189,7 @@ class SRAQueryEngine:
         logger.info(f"Found {len(sra_ids)} experiments for {cancer_type}")
         return sra_ids
     
-    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=(requests.RequestException, ET.ParseError))
+    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=NCBI_HTTP_ERRORS + (ET.ParseError,))
     def fetch_experiment_metadata(self, sra_id: str) -> Optional[Dict]:
         """
         Fetch detailed metadata for SRA experiment.
@@ -129,19 +200,19 @@ class SRAQueryEngine:
         Returns:
             Metadata dictionary or None if fetch fails
         """
+        cached = self._metadata_cache.get(sra_id)
+        if cached is not None:
+            return cached
+        
         logger.debug(f"Fetching metadata for SRA ID: {sra_id}...")
         
         params = {
             'db': 'sra',
             'id': sra_id,
-            'rettype': 'xml',
-            'email': self.email
+            'rettype': 'xml'
         }
         
-        if self.api_key:
-            params['api_key'] = self.api_key
-        
-        response = requests.get(self.fetch_url, params=params, timeout=self.timeout)
+        response = self.session.get(self.fetch_url, params=params, timeout=self.timeout)
         response.raise_for_status()
         
         if not response.content:
@@ -150,12 +221,22 @@ class SRAQueryEngine:
         
         # Parse XML response
         try:
-            root = ET.fromstring(response.content)
+            packages = self._parse_experiment_packages(response.content, [sra_id])
         except ET.ParseError as e:
             logger.error(f"Error parsing XML for {sra_id}: {e}")
             return None
         
-        metadata = {
+        if not packages:
+            logger.warning(f"No EXPERIMENT_PACKAGE in response for {sra_id}")
+            return None
+        if packages[0] is not None:
+            self._metadata_cache[sra_id] = packages[0]
+        return packages[0]
+    
+    @staticmethod
+    def _new_metadata(sra_id: str) -> Dict:
+        """Metadata dict with defaults for one SRA experiment"""
+        return {
             'sra_id': sra_id,
             'experiment_accession': '',
             'run_accession': '',
@@ -171,75 +252,231 @@ class SRAQueryEngine:
             'read_length': 0,
             'base_count': 0,
             'run_count': 0,
+            'total_bases': '0',
+            'total_spots': '0',
             'submission_date': '',
             'publication_date': ''
         }
+    
+    def _parse_experiment(self, metadata: Dict, experiment: ET.Element):
+        """Fill experiment, library and platform fields from an EXPERIMENT element"""
+        metadata['experiment_accession'] = experiment.get('accession', '')
+        title_elem = experiment.find('.//TITLE')
+        if title_elem is not None and title_elem.text:
+            metadata['title'] = title_elem.text
+        
+        # Extract library info
+        design = experiment.find('.//LIBRARY_DESCRIPTOR')
+        if design is not None:
+            strategy = design.find('LIBRARY_STRATEGY')
+            if strategy is not None and strategy.text:
+                metadata['library_strategy'] = strategy.text
+            source = design.find('LIBRARY_SOURCE')
+            if source is not None and source.text:
+                metadata['library_source'] = source.text
+            selection = design.find('LIBRARY_SELECTION')
+            if selection is not None and selection.text:
+                metadata['library_selection'] = selection.text
+        
+        # Extract platform info
+        platform = experiment.find('.//PLATFORM')
+        if platform is not None:
+            for child in platform:
+                metadata['platform'] = child.tag
+                instrument = child.find('INSTRUMENT_MODEL')
+                if instrument is not None and instrument.text:
+                    metadata['instrument_model'] = instrument.text
+    
+    def _parse_run(self, metadata: Dict, run: ET.Element):
+        """Fill run accession, count and raw base/spot totals from a RUN element"""
+        metadata['run_accession'] = run.get('accession', '')
+        metadata['run_count'] += 1
+        
+        # Kept verbatim and divided column-wise in _add_read_metrics; a run whose
+        # totals are not both integers leaves the last parseable run's totals in place
+        total_bases = run.get('total_bases', '0')
+        total_spots = run.get('total_spots', '0')
+        if total_bases.isdigit() and total_spots.isdigit():
+            metadata['total_bases'] = total_bases
+            metadata['total_spots'] = total_spots
+    
+    def _build_frame(self, columns: Dict[str, list]) -> pd.DataFrame:
+        """One cancer type's rows with base_count/read_length derived from the RUN totals"""
+        return self._add_read_metrics(super()._build_frame(columns))
+    
+    @staticmethod
+    def _add_read_metrics(df: pd.DataFrame) -> pd.DataFrame:
+        """Replace the raw RUN totals with base_count and read_length in one vectorized pass"""
+        # _parse_run only keeps digit strings, so coercion just guards the defaults
+        total_bases = pd.to_numeric(df.pop('total_bases'), errors='coerce').fillna(0).astype('int64').to_numpy()
+        total_spots = pd.to_numeric(df.pop('total_spots'), errors='coerce').fillna(0).astype('int64').to_numpy()
+        
+        n_invalid = int(((total_spots <= 0) & (df['run_count'].to_numpy() > 0)).sum())
+        if n_invalid:
+            logger.warning(f"Zero or unparseable total_spots for {n_invalid} experiments - read_length left at 0")
+        
+        df['base_count'] = total_bases
+        df['read_length'] = np.floor_divide(total_bases, total_spots, out=np.zeros_like(total_bases),
+                                            where=total_spots > 0)
+        return df
+    
+    def _parse_experiment_packages(self, content: bytes, sra_ids: List[str]) -> List[Optional[Dict]]:
+        """
+        Parse an efetch response in one streaming pass.
         
-        try:
-            # Extract experiment information
-            for experiment in root.findall('.//EXPERIMENT'):
-                metadata['experiment_accession'] = experiment.get('accession', '')
-                title_elem = experiment.find('.//TITLE')
-                if title_elem is not None and title_elem.text:
-                    metadata['title'] = title_elem.text
-                
-                # Extract library info
-                design = experiment.find('.//LIBRARY_DESCRIPTOR')
-                if design is not None:
-                    strategy = design.find('LIBRARY_STRATEGY')
-                    if strategy is not None and strategy.text:
-                        metadata['library_strategy'] = strategy.text
-                    source = design.find('LIBRARY_SOURCE')
-                    if source is not None and source.text:
-                        metadata['library_source'] = source.text
-                    selection = design.find('LIBRARY_SELECTION')
-                    if selection is not None and selection.text:
-                        metadata['library_selection'] = selection.text
-                
-                # Extract platform info
-                platform = experiment.find('.//PLATFORM')
-                if platform is not None:
-                    for child in platform:
-                        metadata['platform'] = child.tag
-                        instrument = child.find('INSTRUMENT_MODEL')
-                        if instrument is not None and instrument.text:
-                            metadata['instrument_model'] = instrument.text
+        Each EXPERIMENT, RUN, SAMPLE and STUDY element is handled at its end event and then
+        cleared, instead of walking the whole tree once per tag.
+        
+        Args:
+            content: Raw efetch XML
+            sra_ids: IDs in request order, used to label packages in order (empty to leave sra_id blank)
+        
+        Returns:
+            One metadata dict per EXPERIMENT_PACKAGE (None where extraction failed)
+        """
+        handlers = {
+            'EXPERIMENT': self._parse_experiment,
+            'RUN': self._parse_run,
+            'SAMPLE': lambda metadata, elem: metadata.update(sample_accession=elem.get('accession', '')),
+            'STUDY': lambda metadata, elem: metadata.update(study_accession=elem.get('accession', '')),
+        }
+        packages = []
+        metadata = None
+        failed = False
+        
+        for event, elem in ET.iterparse(io.BytesIO(content), events=('start', 'end'), **_ITERPARSE_OPTIONS):
+            if event == 'start':
+                if elem.tag == 'EXPERIMENT_PACKAGE':
+                    index = len(packages)
+                    metadata = self._new_metadata(sra_ids[index] if index < len(sra_ids) else '')
+                    failed = False
+                continue
             
-            # Extract run information
-            for run in root.findall('.//RUN'):
-                metadata['run_accession'] = run.get('accession', '')
-                metadata['run_count'] += 1
-                
-                # Extract read length and base count (with safe division)
-                total_bases_str = run.get('total_bases', '0')
-                total_spots_str = run.get('total_spots', '0')
-                
-                try:
-                    total_bases = int(total_bases_str)
-                    total_spots = int(total_spots_str)
-                    
-                    metadata['base_count'] = total_bases
-                    
-                    if total_spots > 0:
-                        metadata['read_length'] = total_bases // total_spots
-                    else:
-                        logger.warning(f"Zero total_spots for {sra_id}")
-                        
-                except ValueError as e:
-                    logger.warning(f"Could not parse read metrics for {sra_id}: {e}")
+            if metadata is None:
+                continue
             
-            # Extract sample and study info
-            for sample in root.findall('.//SAMPLE'):
-                metadata['sample_accession'] = sample.get('accession', '')
+            if elem.tag == 'EXPERIMENT_PACKAGE':
+                packages.append(None if failed else metadata)
+                metadata = None
+                elem.clear()
+                continue
             
-            for study in root.findall('.//STUDY'):
-                metadata['study_accession'] = study.get('accession', '')
+            handler = handlers.get(elem.tag)
+            if handler is None:
+                continue
+            
+            if not failed:
+                try:
+                    handler(metadata, elem)
+                except Exception as e:
+                    logger.error(f"Error extracting metadata for {metadata['sra_id']}: {e}")
+                    failed = True
             
-            return metadata
+            # Free the handled subtree; the metadata dict holds everything we need
+            elem.clear()
+        
+        return packages
+    
+    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=NCBI_HTTP_ERRORS + (ET.ParseError,))
+    def fetch_experiment_accessions(self, sra_ids: List[str]) -> Dict[str, str]:
+        """
+        Resolve SRA experiment IDs to EXPERIMENT accessions with a single esummary request.
         
+        Args:
+            sra_ids: SRA experiment IDs
+        
+        Returns:
+            EXPERIMENT accessions keyed by SRA ID; IDs without a DocSum are absent
+        """
+        # POST keeps long ID lists out of the URL
+        data = {
+            'db': 'sra',
+            'id': ','.join(sra_ids)
+        }
+        
+        response = self.session.post(self.summary_url, data=data, timeout=self.timeout)
+        response.raise_for_status()
+        
+        if not response.content or not response.content.strip():
+            logger.warning(f"Empty response from NCBI esummary for {len(sra_ids)} SRA IDs")
+            return {}
+        
+        accessions = {}
+        for docsum in ET.fromstring(response.content).iter('DocSum'):
+            sra_id = docsum.findtext('Id', default='')
+            for item in docsum.iter('Item'):
+                if item.get('Name') == 'ExpXml' and item.text:
+                    match = _EXPERIMENT_ACC_RE.search(item.text)
+                    if match:
+                        accessions[sra_id] = match.group(1)
+                    break
+        return accessions
+    
+    @retry_with_backoff(max_attempts=3, initial_delay=2, exceptions=NCBI_HTTP_ERRORS + (ET.ParseError,))
+    def fetch_experiment_metadata_batch(self, sra_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Fetch metadata for many SRA experiments with a single efetch request.
+        
+        Args:
+            sra_ids: SRA experiment IDs
+        
+        Returns:
+            Metadata dictionaries keyed by SRA ID; IDs whose package cannot be identified are absent
+        """
+        logger.debug(f"Fetching metadata for {len(sra_ids)} SRA IDs...")
+        
+        # efetch packages carry no numeric ID and NCBI does not guarantee their order,
+        # so each one is matched to its ID through the EXPERIMENT accession
+        accessions = self.fetch_experiment_accessions(sra_ids)
+        ids_by_accession = {accession: sra_id for sra_id, accession in accessions.items()}
+        if not ids_by_accession:
+            logger.warning(f"No EXPERIMENT accessions resolved for batch of {len(sra_ids)} SRA IDs")
+            return {}
+        
+        # POST keeps long ID lists out of the URL
+        data = {
+            'db': 'sra',
+            'id': ','.join(sra_ids),
+            'rettype': 'xml'
+        }
+        
+        response = self.session.post(self.fetch_url, data=data, timeout=self.timeout)
+        response.raise_for_status()
+        
+        if not response.content:
+            logger.warning(f"Empty response for batch of {len(sra_ids)} SRA IDs")
+            return {}
+        
+        results = {}
+        for metadata in self._parse_experiment_packages(response.content, []):
+            if metadata is None:
+                continue
+            sra_id = ids_by_accession.get(metadata['experiment_accession'])
+            if sra_id is None or sra_id in results:
+                logger.warning(f"Unmatched EXPERIMENT_PACKAGE {metadata['experiment_accession'] or '(no accession)'}")
+                continue
+            metadata['sra_id'] = sra_id
+            results[sra_id] = metadata
+        
+        if len(results) != len(sra_ids):
+            logger.warning(f"Matched {len(results)} of {len(sra_ids)} SRA IDs in batch - fetching the rest one by one")
+        return results
+    
+    def _fetch_batch_safe(self, sra_ids: List[str]) -> List[Optional[Dict]]:
+        """fetch_experiment_metadata_batch for worker threads, falling back to per-ID fetches"""
+        try:
+            results = self.fetch_experiment_metadata_batch(sra_ids)
         except Exception as e:
-            logger.error(f"Error extracting metadata for {sra_id}: {e}")
-            return None
+            logger.warning(f"Failed to fetch metadata for batch of {len(sra_ids)}: {e}")
+            results = {}
+        
+        for sra_id in sra_ids:
+            if sra_id not in results:
+                try:
+                    results[sra_id] = self.fetch_experiment_metadata(sra_id)
+                except Exception as e:
+                    logger.warning(f"Failed to fetch metadata for {sra_id}: {e}")
+        return [results.get(sra_id) for sra_id in sra_ids]
     
     def query_all_cancers(self, max_results_per_cancer: int = 50) -> pd.DataFrame:
         """
@@ -251,34 +488,12 @@ class SRAQueryEngine:
         Returns:
             DataFrame with all retrieved experiments
         """
-        cancer_types = list(config.CANCER_TYPES.keys())
-        all_experiments = []
-        
-        for cancer_type in cancer_types:
-            try:
-                sra_ids = self.search_sra(cancer_type, max_results=max_results_per_cancer)
-                
-                for sra_id in sra_ids:
-                    try:
-                        metadata = self.fetch_experiment_metadata(sra_id)
-                        if metadata:
-                            metadata['cancer_type'] = cancer_type
-                            all_experiments.append(metadata)
-                    except Exception as e:
-                        logger.warning(f"Failed to fetch metadata for {sra_id}: {e}")
-                        continue
-                    
-                    # Rate limiting
-                    time.sleep(0.4)
-            except Exception as e:
-                logger.error(f"Failed to query cancer type {cancer_type}: {e}")
-                continue
-        
-        if not all_experiments:
+        frames = [df for _, df in self.iter_cancer_results(max_results_per_cancer)]
+        if not frames:
             logger.warning("No experiments retrieved from SRA")
             return pd.DataFrame()
         
-        df = pd.DataFrame(all_experiments)
+        df = pd.concat(frames, ignore_index=True)
         logger.info(f"Total experiments retrieved: {len(df)}")
         return df
     
@@ -302,7 +517,7 @@ class SRAQueryEngine:
         mask = df['library_strategy'].str.contains('RNA-Seq', case=False, na=False)
         
         # Exclude single-cell using keywords from config
-        mask &= ~df['title'].str.lower().str.contains('|'.join(config.EXCLUDED_KEYWORDS), na=False)
+        mask &= ~df['title'].str.contains(_EXCLUDE_RE, na=False)
         
         # Exclude low-quality runs (with safe value checks)
         mask &= df['read_length'].fillna(0) >= config.MIN_READ_LENGTH
@@ -330,11 +545,21 @@ class SRAQueryEngine:
             return ""
         
         if output_file is None:
-            output_file = str(config.DATA_DIR / "sra_experiments.csv")
+            output_file = str(config.DATA_DIR / self.OUTPUT_FILE)
         
         try:
             Path(output_file).parent.mkdir(parents=True, exist_ok=True)
-            df.to_csv(output_file, index=False)
+            written = False
+            if pacsv is not None:
+                try:
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    pacsv.write_csv(table, output_file, write_options=pacsv.WriteOptions(include_header=True))
+                    written = True
+                except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                    # Mixed-type object columns; let pandas stringify them
+                    logger.debug(f"Arrow CSV writer rejected table, using pandas: {e}")
+            if not written:
+                df.to_csv(output_file, index=False)
             logger.info(f"Results saved to {output_file} ({len(df)} experiments)")
             return output_file
         except IOError as e:
@@ -349,30 +574,24 @@ def main():
         logger.info("Starting SRA database query...")
         logger.info("=" * 60)
         
-        engine = SRAQueryEngine()
-        
-        # Query all cancer types
-        results_df = engine.query_all_cancers(max_results_per_cancer=config.MAX_SRA_RECORDS)
-        
-        if results_df.empty:
-            logger.error("No experiments retrieved from SRA query")
-            return None
-        
-        # Filter for bulk RNA-seq
-        bulk_rnaseq_df = engine.filter_bulk_rnaseq(results_df)
-        
-        if bulk_rnaseq_df.empty:
-            logger.error("All experiments filtered out - no bulk RNA-seq data found")
-            return None
-        
-        # Save results
-        output_file = engine.save_results(bulk_rnaseq_df)
-        
-        logger.info("=" * 60)
-        logger.info(f"SRA query complete. Found {len(bulk_rnaseq_df)} bulk RNA-seq experiments")
-        logger.info("=" * 60)
-        
-        return bulk_rnaseq_df
+        with SRAQueryEngine() as engine:
+            engine.load_metadata_cache()
+            try:
+                # Query, filter for bulk RNA-seq and save one cancer type at a time
+                bulk_rnaseq_df = engine.stream_results(max_results_per_cancer=config.MAX_SRA_RECORDS)
+            finally:
+                # Checkpoint even after a failure so the rerun skips metadata already fetched
+                engine.save_metadata_cache()
+            
+            if bulk_rnaseq_df.empty:
+                logger.error("No bulk RNA-seq experiments retrieved from SRA query")
+                return None
+            
+            logger.info("=" * 60)
+            logger.info(f"SRA query complete. Found {len(bulk_rnaseq_df)} bulk RNA-seq experiments")
+            logger.info("=" * 60)
+            
+            return bulk_rnaseq_df
     
     except Exception as e:
         logger.error(f"Fatal error during SRA query: {e}", exc_info=True)
@@ -5,14 +5,18 @@ Queries European Nucleotide Archive for RNA-seq studies across cancer types
 Updated
 """
 
+import re
+import json
+import functools
 import requests
 import pandas as pd
+import numpy as np
 from typing import List, Dict
 import logging
-import time
-import json
+from concurrent.futures import ThreadPoolExecutor
 from config import MAX_ENA_RECORDS, DATA_DIR, CANCER_TYPES
 import config
+from http_utils import TokenBucket, build_session
 
 # Configure logging
 logging.basicConfig(
@@ -25,14 +29,115 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Filter patterns compiled once; IGNORECASE replaces lower-casing every description
+_EXCLUDE_RE = re.compile('|'.join(map(re.escape, config.EXCLUDED_KEYWORDS)), re.IGNORECASE)
+_RNASEQ_RE = re.compile(re.escape('RNA-Seq'), re.IGNORECASE)
+
+# orjson decodes the large read_run responses several times faster than the stdlib
+try:
+    import orjson
+    decode_json = orjson.loads
+except ImportError:
+    decode_json = json.loads
+
+# Numba fuses the read length division, fill and cast into one pass when installed
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Below this many runs the NumPy path is faster than compiling the Numba kernel
+NUMBA_MIN_RUNS = 100_000
+
+
+def _read_lengths(base_counts, read_counts):
+    """Integer mean read length per run; 0 where a count is missing or read_count is not positive"""
+    read_lengths = np.zeros(base_counts.shape[0], dtype=np.int32)
+    for i in range(base_counts.shape[0]):
+        if read_counts[i] > 0 and base_counts[i] >= 0:
+            read_lengths[i] = int(base_counts[i] / read_counts[i])
+    return read_lengths
+
+read_lengths_kernel = njit(cache=True, nogil=True)(_read_lengths) if njit else None
+
+
+def compute_read_lengths(base_counts: np.ndarray, read_counts: np.ndarray) -> np.ndarray:
+    """base_count // read_count as int32, with 0 for missing counts and runs without reads"""
+    if read_lengths_kernel is not None and base_counts.shape[0] >= NUMBA_MIN_RUNS:
+        return read_lengths_kernel(base_counts, read_counts)
+    
+    valid = (read_counts > 0) & (base_counts >= 0)
+    return np.divide(base_counts, read_counts, out=np.zeros_like(base_counts), where=valid).astype(np.int32)
+
+
+# One bucket per process, shared by every engine instance and worker thread
+ENA_RATE_LIMITER = TokenBucket(config.ENA_REQUESTS_PER_SECOND, 1)
+
+
+@functools.lru_cache(maxsize=8192)
+def _fetch_sample_record(session: requests.Session, search_url: str, sample_accession: str) -> Dict:
+    """Sample record memoized per session and accession; request errors propagate and are not cached"""
+    logger.info(f"Fetching metadata for sample {sample_accession}...")
+    
+    params = {
+        'query': f'sample_accession="{sample_accession}"',
+        'result': 'sample',
+        'format': 'json',
+        'limit': 1
+    }
+    
+    response = session.get(search_url, params=params, timeout=30)
+    response.raise_for_status()
+    data = decode_json(response.content)
+    
+    # Handle both list and dict responses
+    if isinstance(data, list) and len(data) > 0:
+        return data[0]
+    elif isinstance(data, dict) and 'results' in data and len(data['results']) > 0:
+        return data['results'][0]
+    else:
+        return {}
+
+
 class ENAQueryEngine:
     """Query ENA database for bulk RNA-seq cancer datasets"""
     
+    # Fields copied from each run record, after the study-level columns
+    RUN_FIELDS = ('experiment_accession', 'sample_accession', 'instrument_model',
+                  'library_strategy', 'library_source', 'library_selection',
+                  'read_count', 'base_count', 'first_created', 'last_updated')
+    RUN_COLUMNS = ('cancer_type', 'study_accession', 'run_accession', 'description') + RUN_FIELDS
+    # Studies combined into one OR query by fetch_runs_for_studies
+    STUDY_BATCH_SIZE = 50
+    MAX_RUNS_PER_STUDY = 1000
+    
     def __init__(self):
         self.portal_url = "https://www.ebi.ac.uk/ena/portal/api"
         self.search_url = f"{self.portal_url}/search"
         self.retrieve_url = f"{self.portal_url}/retrieve"
         self.datasets = []
+        self.session = self._build_session()
+    
+    def _build_session(self) -> requests.Session:
+        """Build a keep-alive session shared by the worker threads"""
+        # Study, run and sample lookups are answered from disk on reruns
+        return build_session(
+            ENA_RATE_LIMITER.acquire,
+            cache_name=str(DATA_DIR / 'ena_cache'),
+            expire_seconds=config.ENA_CACHE_EXPIRE_SECONDS,
+            pool_connections=4,
+            pool_maxsize=config.ENA_MAX_CONCURRENCY
+        )
+    
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def build_ena_query(self, cancer_type: str) -> str:
         """Build ENA search query for Homo sapiens RNA-Seq studies"""
@@ -56,9 +161,9 @@ class ENAQueryEngine:
         }
         
         try:
-            response = requests.get(self.search_url, params=params, timeout=30)
+            response = self.session.get(self.search_url, params=params, timeout=30)
             response.raise_for_status()
-            data = response.json()
+            data = decode_json(response.content)
             
             # ENA API returns list directly, not dict with 'results' key
             if isinstance(data, list):
@@ -72,26 +177,28 @@ class ENAQueryEngine:
                 logger.warning(f"Unexpected response format for {cancer_type}")
                 return []
                 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             logger.error(f"Error searching ENA: {e}")
             return []
     
-    def fetch_study_runs(self, study_accession: str) -> List[Dict]:
-        """Fetch all runs associated with a study"""
-        logger.info(f"Fetching runs for study {study_accession}...")
+    def fetch_runs_for_studies(self, study_accessions: List[str]) -> Dict[str, List[Dict]]:
+        """Fetch the runs of several studies with a single OR query, grouped by study"""
+        logger.info(f"Fetching runs for {len(study_accessions)} studies...")
         
         params = {
-            'query': f'study_accession="{study_accession}"',
+            'query': ' OR '.join(f'study_accession="{study_accession}"' for study_accession in study_accessions),
             'result': 'read_run',
             'format': 'json',
-            'limit': 1000,
-            'fields': 'run_accession,sample_accession,experiment_accession,library_strategy,library_source,library_selection,instrument_model,read_count,base_count,first_created,last_updated'
+            'limit': 0,  # All runs; capped per study below
+            'fields': 'study_accession,run_accession,sample_accession,experiment_accession,library_strategy,library_source,library_selection,instrument_model,read_count,base_count,first_created,last_updated'
         }
         
+        runs_by_study = {study_accession: [] for study_accession in study_accessions}
+        
         try:
-            response = requests.get(self.search_url, params=params, timeout=30)
+            response = self.session.get(self.search_url, params=params, timeout=60)
             response.raise_for_status()
-            data = response.json()
+            data = decode_json(response.content)
             
             # Handle both list and dict responses
             if isinstance(data, list):
@@ -101,38 +208,24 @@ class ENAQueryEngine:
             else:
                 runs = []
             
-            logger.info(f"Found {len(runs)} runs for study {study_accession}")
-            return runs
+            for run in runs:
+                study_runs = runs_by_study.get(run.get('study_accession'))
+                if study_runs is not None and len(study_runs) < self.MAX_RUNS_PER_STUDY:
+                    study_runs.append(run)
+            
+            logger.info(f"Found {len(runs)} runs for {len(study_accessions)} studies")
                 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching runs for {study_accession}: {e}")
-            return []
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error fetching runs for studies {study_accessions[0]}..{study_accessions[-1]}: {e}")
+        
+        return runs_by_study
     
     def fetch_sample_metadata(self, sample_accession: str) -> Dict:
         """Fetch metadata for a specific sample"""
-        logger.info(f"Fetching metadata for sample {sample_accession}...")
-        
-        params = {
-            'query': f'sample_accession="{sample_accession}"',
-            'result': 'sample',
-            'format': 'json',
-            'limit': 1
-        }
-        
         try:
-            response = requests.get(self.search_url, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Handle both list and dict responses
-            if isinstance(data, list) and len(data) > 0:
-                return data[0]
-            elif isinstance(data, dict) and 'results' in data and len(data['results']) > 0:
-                return data['results'][0]
-            else:
-                return {}
-                
-        except requests.exceptions.RequestException as e:
+            # Copy so callers never modify the memoized record
+            return dict(_fetch_sample_record(self.session, self.search_url, sample_accession))
+        except (requests.exceptions.RequestException, ValueError) as e:
             logger.error(f"Error fetching sample metadata for {sample_accession}: {e}")
             return {}
     
@@ -142,6 +235,7 @@ class ENAQueryEngine:
             max_results_per_cancer = MAX_ENA_RECORDS
         
         all_runs = []
+        matched_studies = []
         cancer_types = list(config.CANCER_TYPES.keys())
         logger.info(f"Querying ENA for {len(cancer_types)} cancer types: {', '.join(cancer_types)}")
         
@@ -180,36 +274,31 @@ class ENAQueryEngine:
                         continue
                 
                 logger.debug(f"Processing study {idx+1}/{len(studies)}: {study_accession} (matched: {matched_cancer_type})")
+                matched_studies.append((study_accession, study_desc, matched_cancer_type))
+            
+            # Fetch runs STUDY_BATCH_SIZE studies per request, batches concurrently;
+            # ENA_RATE_LIMITER paces the workers
+            study_accessions = list(dict.fromkeys(study_accession for study_accession, _, _ in matched_studies))
+            batches = [study_accessions[start:start + self.STUDY_BATCH_SIZE]
+                       for start in range(0, len(study_accessions), self.STUDY_BATCH_SIZE)]
+            runs_by_study = {}
+            with ThreadPoolExecutor(max_workers=config.ENA_MAX_CONCURRENCY) as executor:
+                for batch_runs in executor.map(self.fetch_runs_for_studies, batches):
+                    runs_by_study.update(batch_runs)
                 
-                # Fetch runs for this study
-                runs = self.fetch_study_runs(study_accession)
-                
-                for run in runs:
-                    run_data = {
-                        'cancer_type': matched_cancer_type,
-                        'study_accession': study_accession,
-                        'run_accession': run.get('run_accession', ''),
-                        'description': study_desc,
-                        'raw_data': json.dumps(run)
-                    }
-                    
-                    # Try to extract useful fields if they exist
-                    for key in ['experiment_accession', 'sample_accession', 'instrument_model', 
-                                'library_strategy', 'library_source', 'library_selection',
-                                'read_count', 'base_count', 'first_created', 'last_updated']:
-                        if key in run:
-                            run_data[key] = run[key]
-                    
-                    all_runs.append(run_data)
-                
-                # Rate limiting
-                time.sleep(0.3)
+                for study_accession, study_desc, matched_cancer_type in matched_studies:
+                    # One tuple per run in RUN_COLUMNS order
+                    for run in runs_by_study[study_accession]:
+                        all_runs.append((matched_cancer_type, study_accession, run.get('run_accession', ''), study_desc)
+                                        + tuple(run.get(key) for key in self.RUN_FIELDS))
                 
         except Exception as e:
             logger.warning(f"Error querying ENA: {e}")
             pass
         
-        df = pd.DataFrame(all_runs)
+        df = pd.DataFrame.from_records(all_runs, columns=self.RUN_COLUMNS)
+        # Study-level values repeat on every run of the study; library_strategy has a handful of values
+        df = df.astype({'study_accession': 'category', 'description': 'category', 'library_strategy': 'category'})
         logger.info(f"Total runs retrieved: {len(df)}")
         return df
     
@@ -225,11 +314,16 @@ class ENAQueryEngine:
         
         # Filter for RNA-Seq strategy if column exists
         if 'library_strategy' in df.columns:
-            mask &= df['library_strategy'].fillna('').astype(str).str.contains('RNA-Seq', case=False, na=False)
+            # Regex runs once per distinct strategy, rows are matched by category code
+            strategy = df['library_strategy'].astype('category')
+            categories = strategy.cat.categories
+            is_rnaseq = categories.astype(str).str.contains(_RNASEQ_RE) if len(categories) else np.zeros(0, dtype=bool)
+            # Missing values have code -1, which indexes the trailing False
+            mask &= np.append(is_rnaseq, False)[strategy.cat.codes.to_numpy()]
         
         # Exclude single-cell using keywords from config
         if 'description' in df.columns:
-            mask &= ~df['description'].fillna('').astype(str).str.lower().str.contains('|'.join(config.EXCLUDED_KEYWORDS), na=False)
+            mask &= ~df['description'].str.contains(_EXCLUDE_RE, na=False)
         
         # Exclude low-quality runs if columns exist
         # Convert read_count and base_count to numeric if they exist
@@ -249,7 +343,8 @@ class ENAQueryEngine:
         # Calculate read length if needed
         if 'read_count' in df.columns and 'base_count' in df.columns:
             try:
-                df['read_length'] = (df['base_count'] / df['read_count']).fillna(0).astype(int)
+                df['read_length'] = compute_read_lengths(df['base_count'].to_numpy(dtype=np.float64, na_value=np.nan),
+                                                         df['read_count'].to_numpy(dtype=np.float64, na_value=np.nan))
                 mask &= df['read_length'] >= 50
             except Exception as e:
                 logger.warning(f"Could not calculate read_length: {e}")
@@ -273,28 +368,27 @@ def main():
     logger.info("Starting ENA database query...")
     
     try:
-        engine = ENAQueryEngine()
-        
-        # Query all cancer types
-        results_df = engine.query_all_cancers()  # Uses MAX_ENA_RECORDS from config
-        
-        if results_df.empty:
-            logger.warning("No results retrieved from ENA")
-            return pd.DataFrame()
-        
-        # Filter for bulk RNA-seq
-        bulk_rnaseq_df = engine.filter_bulk_rnaseq(results_df)
-        
-        if bulk_rnaseq_df.empty:
-            logger.warning("No bulk RNA-seq runs after filtering")
-            return pd.DataFrame()
-        
-        # Save results
-        output_file = engine.save_results(bulk_rnaseq_df)
-        
-        logger.info(f"ENA query complete. Found {len(bulk_rnaseq_df)} bulk RNA-seq runs")
-        
-        return bulk_rnaseq_df
+        with ENAQueryEngine() as engine:
+            # Query all cancer types
+            results_df = engine.query_all_cancers()  # Uses MAX_ENA_RECORDS from config
+            
+            if results_df.empty:
+                logger.warning("No results retrieved from ENA")
+                return pd.DataFrame()
+            
+            # Filter for bulk RNA-seq
+            bulk_rnaseq_df = engine.filter_bulk_rnaseq(results_df)
+            
+            if bulk_rnaseq_df.empty:
+                logger.warning("No bulk RNA-seq runs after filtering")
+                return pd.DataFrame()
+            
+            # Save results
+            output_file = engine.save_results(bulk_rnaseq_df)
+            
+            logger.info(f"ENA query complete. Found {len(bulk_rnaseq_df)} bulk RNA-seq runs")
+            
+            return bulk_rnaseq_df
     
     except Exception as e:
         logger.error(f"Fatal error in ENA query: {e}", exc_info=True)
@@ -12,6 +12,13 @@ import hashlib
 from pathlib import Path
 from config import DATA_DIR
 
+# Native multithreaded CSV reader when pyarrow is installed
+try:
+    import pyarrow
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +33,24 @@ logger = logging.getLogger(__name__)
 class MetadataConsolidator:
     """Consolidate metadata from multiple databases"""
     
+    # Identifier, text and date columns are read as strings, skipping type inference and
+    # keeping the pyarrow engine from turning dates into timestamps
+    CSV_DTYPES = {
+        'GEO': dict.fromkeys(('gse_id', 'title', 'summary', 'organism', 'platform',
+                              'submission_date', 'last_update', 'cancer_type'), str),
+        'SRA': dict.fromkeys(('experiment_accession', 'run_accession', 'sample_accession',
+                              'study_accession', 'title', 'organism', 'library_strategy',
+                              'library_source', 'library_selection', 'platform', 'instrument_model',
+                              'submission_date', 'publication_date', 'cancer_type'), str),
+        'ENA': dict.fromkeys(('cancer_type', 'study_accession', 'run_accession', 'description',
+                              'experiment_accession', 'sample_accession', 'instrument_model',
+                              'library_strategy', 'library_source', 'library_selection',
+                              'first_created', 'last_updated'), str),
+    }
+    
+    # Repeat-valued columns of the consolidated table, stored as category
+    CATEGORY_COLUMNS = ('database', 'organism', 'platform', 'instrument_model', 'cancer_type')
+    
     def __init__(self):
         self.geo_df = None
         self.sra_df = None
@@ -48,21 +73,21 @@ class MetadataConsolidator:
             ena_file = str(DATA_DIR / 'ena_runs.csv')
         
         try:
-            self.geo_df = pd.read_csv(geo_file)
+            self.geo_df = pd.read_csv(geo_file, dtype=self.CSV_DTYPES['GEO'], engine=CSV_ENGINE)
             logger.info(f"Loaded {len(self.geo_df)} GEO datasets from {geo_file}")
         except FileNotFoundError:
             logger.warning(f"GEO file not found: {geo_file}")
             self.geo_df = pd.DataFrame()
         
         try:
-            self.sra_df = pd.read_csv(sra_file)
+            self.sra_df = pd.read_csv(sra_file, dtype=self.CSV_DTYPES['SRA'], engine=CSV_ENGINE)
             logger.info(f"Loaded {len(self.sra_df)} SRA experiments from {sra_file}")
         except FileNotFoundError:
             logger.warning(f"SRA file not found: {sra_file}")
             self.sra_df = pd.DataFrame()
         
         try:
-            self.ena_df = pd.read_csv(ena_file)
+            self.ena_df = pd.read_csv(ena_file, dtype=self.CSV_DTYPES['ENA'], engine=CSV_ENGINE)
             logger.info(f"Loaded {len(self.ena_df)} ENA runs from {ena_file}")
         except FileNotFoundError:
             logger.warning(f"ENA file not found: {ena_file}")
@@ -70,71 +95,61 @@ class MetadataConsolidator:
         
         return self.geo_df, self.sra_df, self.ena_df
     
-    def standardize_geo_metadata(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Standardize GEO metadata to common schema"""
-        logger.info("Standardizing GEO metadata...")
-        
-        standardized = pd.DataFrame({
-            'database': 'GEO',
-            'accession': df.get('gse_id', ''),
-            'title': df.get('title', ''),
-            'organism': df.get('organism', 'Homo sapiens'),
-            'sample_count': df.get('sample_count', 0),
-            'platform': df.get('platform', ''),
-            'cancer_type': df.get('cancer_type', ''),
-            'submission_date': df.get('submission_date', ''),
-            'last_update': df.get('last_update', ''),
-            'data_type': 'bulk_rnaseq'
-        })
-        
-        return standardized
-    
-    def standardize_sra_metadata(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Standardize SRA metadata to common schema"""
-        logger.info("Standardizing SRA metadata...")
-        
-        standardized = pd.DataFrame({
-            'database': 'SRA',
-            'accession': df.get('run_accession', ''),
-            'study_accession': df.get('study_accession', ''),
-            'experiment_accession': df.get('experiment_accession', ''),
-            'sample_accession': df.get('sample_accession', ''),
-            'title': df.get('title', ''),
-            'organism': df.get('organism', 'Homo sapiens'),
-            'platform': df.get('platform', ''),
-            'instrument_model': df.get('instrument_model', ''),
-            'read_length': df.get('read_length', 0),
-            'base_count': df.get('base_count', 0),
-            'cancer_type': df.get('cancer_type', ''),
-            'submission_date': df.get('submission_date', ''),
-            'data_type': 'bulk_rnaseq'
-        })
-        
-        return standardized
+    # Common schema per database: (column, source column or None for a constant, default)
+    STANDARD_COLUMNS = {
+        'GEO': [
+            ('database', None, 'GEO'),
+            ('accession', 'gse_id', ''),
+            ('title', 'title', ''),
+            ('organism', 'organism', 'Homo sapiens'),
+            ('sample_count', 'sample_count', 0),
+            ('platform', 'platform', ''),
+            ('cancer_type', 'cancer_type', ''),
+            ('submission_date', 'submission_date', ''),
+            ('last_update', 'last_update', ''),
+            ('data_type', None, 'bulk_rnaseq'),
+        ],
+        'SRA': [
+            ('database', None, 'SRA'),
+            ('accession', 'run_accession', ''),
+            ('study_accession', 'study_accession', ''),
+            ('experiment_accession', 'experiment_accession', ''),
+            ('sample_accession', 'sample_accession', ''),
+            ('title', 'title', ''),
+            ('organism', 'organism', 'Homo sapiens'),
+            ('platform', 'platform', ''),
+            ('instrument_model', 'instrument_model', ''),
+            ('read_length', 'read_length', 0),
+            ('base_count', 'base_count', 0),
+            ('cancer_type', 'cancer_type', ''),
+            ('submission_date', 'submission_date', ''),
+            ('data_type', None, 'bulk_rnaseq'),
+        ],
+        'ENA': [
+            ('database', None, 'ENA'),
+            ('accession', 'run_accession', ''),
+            ('study_accession', 'study_accession', ''),
+            ('experiment_accession', 'experiment_accession', ''),
+            ('sample_accession', 'sample_accession', ''),
+            ('title', 'study_title', ''),
+            ('organism', None, 'Homo sapiens'),
+            ('platform', None, 'Illumina'),
+            ('instrument_model', 'instrument_model', ''),
+            ('read_length', 'read_length', 0),
+            ('read_count', 'read_count', 0),
+            ('base_count', 'base_count', 0),
+            ('cancer_type', 'cancer_type', ''),
+            ('submission_date', 'first_created', ''),
+            ('data_type', None, 'bulk_rnaseq'),
+        ],
+    }
     
-    def standardize_ena_metadata(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Standardize ENA metadata to common schema"""
-        logger.info("Standardizing ENA metadata...")
-        
-        standardized = pd.DataFrame({
-            'database': 'ENA',
-            'accession': df.get('run_accession', ''),
-            'study_accession': df.get('study_accession', ''),
-            'experiment_accession': df.get('experiment_accession', ''),
-            'sample_accession': df.get('sample_accession', ''),
-            'title': df.get('study_title', ''),
-            'organism': 'Homo sapiens',
-            'platform': 'Illumina',
-            'instrument_model': df.get('instrument_model', ''),
-            'read_length': df.get('read_length', 0),
-            'read_count': df.get('read_count', 0),
-            'base_count': df.get('base_count', 0),
-            'cancer_type': df.get('cancer_type', ''),
-            'submission_date': df.get('first_created', ''),
-            'data_type': 'bulk_rnaseq'
-        })
-        
-        return standardized
+    @staticmethod
+    def _column_values(df: pd.DataFrame, source: str, default) -> np.ndarray:
+        """Values of one source column, or the default repeated when the column is absent"""
+        if source is not None and source in df.columns:
+            return df[source].to_numpy()
+        return np.full(len(df), default, dtype=object if isinstance(default, str) else None)
     
     def detect_duplicates(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, List[List[int]]]:
         """Detect potential duplicate samples across databases"""
@@ -142,24 +157,55 @@ class MetadataConsolidator:
         
         duplicates = []
         
-        # Create hash of key identifiers for duplicate detection
-        for idx, row in df.iterrows():
-            # Look for samples with similar titles and similar read characteristics
-            similar_mask = (
-                (df['title'].str.lower() == row['title'].lower()) &
-                (df['organism'] == row['organism']) &
-                (df['cancer_type'] == row['cancer_type']) &
-                (df.index != idx)
-            )
-            
-            similar_indices = df[similar_mask].index.tolist()
-            
-            if similar_indices:
-                # Check if this combination hasn't been recorded yet
-                duplicate_group = sorted([idx] + similar_indices)
-                if duplicate_group not in duplicates:
-                    duplicates.append(duplicate_group)
-                    logger.warning(f"Potential duplicate detected: {duplicate_group}")
+        key_columns = ['title', 'organism', 'cancer_type']
+        if not set(key_columns).issubset(df.columns) or df[key_columns].isna().all().any():
+            logger.warning("Skipping duplicate detection: title, organism or cancer_type is not populated")
+            return df, duplicates
+        
+        # Titles are lowercased once for the whole frame; only samples with every key and a
+        # non-empty title can match
+        titles = df['title'].fillna('').str.lower().to_numpy()
+        keyed_positions = np.flatnonzero((titles != '') & df['organism'].notna().to_numpy()
+                                         & df['cancer_type'].notna().to_numpy())
+        
+        # One SHA1 signature per sample over title (case-insensitive), organism and cancer
+        # type, grouped by hash
+        signatures = [
+            hashlib.sha1(f'{title}|{organism}|{cancer_type}'.encode()).digest()
+            for title, organism, cancer_type
+            in zip(titles[keyed_positions], df['organism'].to_numpy()[keyed_positions],
+                   df['cancer_type'].to_numpy()[keyed_positions])
+        ]
+        groups = pd.Series(signatures, dtype=object).groupby(signatures, sort=False).indices.values()
+        
+        # Sequencing depth in 1 Gb buckets splits a group only among samples that report it;
+        # GEO series and unparseable runs (missing or zero base_count) have unknown depth
+        # and join every bucket of their group
+        if 'base_count' in df.columns:
+            base_counts = pd.to_numeric(df['base_count'], errors='coerce').to_numpy(dtype=float)[keyed_positions]
+        else:
+            base_counts = np.full(len(keyed_positions), np.nan)
+        has_depth = base_counts > 0
+        depth_buckets = np.where(has_depth, base_counts, 0) // 1_000_000_000
+        
+        candidates = []
+        for members in groups:
+            if len(members) < 2:
+                continue
+            known = members[has_depth[members]]
+            unknown = members[~has_depth[members]]
+            if len(known) == 0:
+                candidates.append(members)
+                continue
+            for bucket in np.unique(depth_buckets[known]):
+                candidates.append(np.concatenate([known[depth_buckets[known] == bucket], unknown]))
+        
+        # Report groups in order of their first row
+        for members in sorted(candidates, key=lambda members: members.min()):
+            if len(members) > 1:
+                duplicate_group = sorted(df.index[keyed_positions[members]].tolist())
+                duplicates.append(duplicate_group)
+                logger.warning(f"Potential duplicate detected: {duplicate_group}")
         
         return df, duplicates
     
@@ -167,22 +213,33 @@ class MetadataConsolidator:
         """Consolidate all metadata into single dataframe"""
         logger.info("Consolidating metadata from all databases...")
         
-        dfs_to_concat = []
-        
-        if not self.geo_df.empty:
-            geo_std = self.standardize_geo_metadata(self.geo_df)
-            dfs_to_concat.append(geo_std)
-        
-        if not self.sra_df.empty:
-            sra_std = self.standardize_sra_metadata(self.sra_df)
-            dfs_to_concat.append(sra_std)
-        
-        if not self.ena_df.empty:
-            ena_std = self.standardize_ena_metadata(self.ena_df)
-            dfs_to_concat.append(ena_std)
-        
-        if dfs_to_concat:
-            self.consolidated_df = pd.concat(dfs_to_concat, ignore_index=True)
+        sources = [(database, df) for database, df in
+                   (('GEO', self.geo_df), ('SRA', self.sra_df), ('ENA', self.ena_df)) if not df.empty]
+        
+        if sources:
+            # Each output column is one concatenation of the per-database arrays, so no
+            # per-database DataFrame is built; columns a database lacks are NaN there
+            schemas = [dict((column, (source, default)) for column, source, default in self.STANDARD_COLUMNS[database])
+                       for database, _ in sources]
+            columns = dict.fromkeys(column for schema in schemas for column in schema)
+            data = {}
+            for column in columns:
+                parts = []
+                for (database, df), schema in zip(sources, schemas):
+                    if column in schema:
+                        parts.append(self._column_values(df, *schema[column]))
+                    else:
+                        parts.append(np.full(len(df), np.nan))
+                data[column] = np.concatenate(parts)
+            
+            # Few distinct values per column: integer codes make value_counts and groupby cheap.
+            # Categories keep first-appearance order so value_counts ties rank as with object columns
+            for column in self.CATEGORY_COLUMNS:
+                if column in data:
+                    values = data[column]
+                    data[column] = pd.Categorical(values, categories=pd.unique(values[pd.notna(values)]))
+            
+            self.consolidated_df = pd.DataFrame(data, copy=False)
             logger.info(f"Consolidated {len(self.consolidated_df)} total samples")
         else:
             logger.error("No data to consolidate")
@@ -194,18 +251,22 @@ class MetadataConsolidator:
         """Add additional metadata columns for curation"""
         logger.info("Adding metadata columns...")
         
-        df['sequencing_type'] = df['read_length'].apply(
-            lambda x: 'paired-end' if x > 100 else 'single-end' if x > 0 else 'unknown'
-        )
-        
-        df['quality_flag'] = 'pass'
+        read_length = df['read_length'].to_numpy()
+        sequencing_type = np.select([read_length > 100, read_length > 0],
+                                    ['paired-end', 'single-end'], default='unknown')
+        df['sequencing_type'] = pd.Categorical(sequencing_type, categories=pd.unique(sequencing_type))
         
-        # Flag low-quality samples
+        # Flag low-quality samples; low depth takes precedence over short reads
+        conditions = []
+        choices = []
+        if 'base_count' in df.columns:
+            conditions.append(df['base_count'].to_numpy() < 1e9)
+            choices.append('low_depth')
         if 'read_length' in df.columns:
-            df.loc[df['read_length'] < 50, 'quality_flag'] = 'low_read_length'
+            conditions.append(read_length < 50)
+            choices.append('low_read_length')
         
-        if 'base_count' in df.columns:
-            df.loc[df['base_count'] < 1e9, 'quality_flag'] = 'low_depth'
+        df['quality_flag'] = pd.Categorical(np.select(conditions, choices, default='pass'))
         
         df['curation_status'] = 'pending'
         df['notes'] = ''
@@ -228,12 +289,24 @@ class MetadataConsolidator:
         return stats
     
     def save_consolidated_metadata(self, df: pd.DataFrame, output_file: str = None):
-        """Save consolidated metadata to CSV"""
+        """Save consolidated metadata to CSV, plus a Snappy Parquet copy that keeps dtypes"""
         if output_file is None:
             output_file = str(DATA_DIR / 'consolidated_metadata.csv')
         
+        # The CSV stays the hand-off to the download orchestrator and for manual curation
         df.to_csv(output_file, index=False)
         logger.info(f"Consolidated metadata saved to {output_file}")
+        
+        parquet_file = str(Path(output_file).with_suffix('.parquet'))
+        try:
+            df.to_parquet(parquet_file, compression='snappy', index=False)
+            logger.info(f"Consolidated metadata saved to {parquet_file}")
+        except ImportError:
+            logger.warning(f"No Parquet engine (pyarrow) installed, skipping {parquet_file}")
+        except (TypeError, ValueError) as e:
+            # Columns mixing value types cannot be stored as one Arrow type
+            logger.warning(f"Could not write {parquet_file}: {e}")
+        
         return output_file
     
     def save_duplicate_report(self, output_file: str = None):
@@ -241,18 +314,27 @@ class MetadataConsolidator:
         if output_file is None:
             output_file = str(DATA_DIR / 'duplicate_report.txt')
         
-        with open(output_file, 'w') as f:
+        # Every listed row is pulled out in one take instead of one iloc Series per row
+        rows_by_group = [[] for _ in self.duplicates]
+        if self.consolidated_df is not None:
+            n_rows = len(self.consolidated_df)
+            group_positions = [[idx for idx in group if idx < n_rows] for group in self.duplicates]
+            flat_positions = [idx for positions in group_positions for idx in positions]
+            rows = self.consolidated_df.take(flat_positions)[['database', 'accession', 'title']].to_numpy()
+            offset = 0
+            for i, positions in enumerate(group_positions):
+                rows_by_group[i] = rows[offset:offset + len(positions)]
+                offset += len(positions)
+        
+        with open(output_file, 'w', buffering=1 << 20) as f:
             f.write("Duplicate Sample Detection Report\n")
             f.write("=" * 50 + "\n\n")
             f.write(f"Total duplicate groups detected: {len(self.duplicates)}\n\n")
             
-            for i, group in enumerate(self.duplicates, 1):
+            for i, (group, group_rows) in enumerate(zip(self.duplicates, rows_by_group), 1):
                 f.write(f"Group {i}: {group}\n")
-                if self.consolidated_df is not None:
-                    for idx in group:
-                        if idx < len(self.consolidated_df):
-                            row = self.consolidated_df.iloc[idx]
-                            f.write(f"  - {row['database']}: {row['accession']} ({row['title']})\n")
+                for database, accession, title in group_rows:
+                    f.write(f"  - {database}: {accession} ({title})\n")
                 f.write("\n")
         
         logger.info(f"Duplicate report saved to {output_file}")
@@ -6,25 +6,52 @@ Manages downloads from SRA, ENA, and GEO with parallel processing, retry logic,
 
 import subprocess
 import pandas as pd
+import numpy as np
 import os
 import hashlib
+import mmap
+import shutil
 import logging
-from typing import List, Dict, Tuple
+import atexit
+import queue
+import threading
+import itertools
+import random
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Optional, Tuple, Union
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
+import re
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin
+from logging.handlers import QueueHandler, QueueListener
+from http_utils import TokenBucket
 
-# Configure logging
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Pipeline-internal integrity hash; MD5 is only used to compare against provider checksums
+INTERNAL_CHECKSUM = 'xxh3_64' if xxhash is not None else 'sha256'
+
+# Configure logging: worker threads only enqueue records, a background
+# listener thread does the file/console writes
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler('download_orchestrator.log'),
+    logging.StreamHandler()
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('download_orchestrator.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 class FASTQDownloadOrchestrator:
@@ -32,26 +59,212 @@ class FASTQDownloadOrchestrator:
     
     def __init__(self, metadata_file: str = 'consolidated_metadata.csv',
                  output_dir: str = 'fastq_downloads',
-                 max_workers: int = 4):
+                 net_workers: int = 32,
+                 cpu_workers: Optional[int] = None,
+                 per_host_limit: int = 8,
+                 requests_per_second: float = 5.0):
         self.metadata_df = pd.read_csv(metadata_file)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.max_workers = max_workers
-        self.download_log = []
-        self.failed_downloads = []
+        # Network-bound fetches and CPU-bound checksums run in separate pools
+        self.net_workers = net_workers
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self._cpu_worker_ids = itertools.count()
+        # Up to per_host_limit fasterq-dump runs share the CPUs; pigz (4 threads each)
+        # runs outside the host slots, bounded so it does not oversubscribe them either
+        self.fasterq_threads = max(1, self.cpu_workers // per_host_limit)
+        self._compress_slots = threading.Semaphore(max(1, self.cpu_workers // 4))
+        # Per-thread reusable buffers for downloads and the checksum fallback path
+        self._thread_local = threading.local()
+        # Cap in-flight requests per remote server to respect its limits
+        self.host_semaphores = {
+            database: threading.Semaphore(per_host_limit)
+            for database in ('SRA', 'ENA', 'GEO')
+        }
+        # Smooth request starts per server; retries back off outside the semaphore
+        self.rate_limiters = {
+            database: TokenBucket(rate=requests_per_second, capacity=per_host_limit)
+            for database in ('SRA', 'ENA', 'GEO')
+        }
+        # Column arrays with one pre-assigned row per queued sample (see _allocate_download_log)
+        self.download_log = {}
+        # Accession -> per-file verification results, kept out of the row arrays
+        self.verification = {}
+        # Internal digests computed while streaming, keyed by destination path
+        self.stream_checksums = {}
+        # ENA run accession -> [(url, md5, size), ...] from the filereport preflight
+        self.ena_manifest = {}
+        self.session = self._build_session()
+        # Database -> downloader, resolved with one dict lookup per sample
+        self._dispatch: Dict[str, Callable[[str, Path], Tuple[bool, str]]] = {
+            'SRA': self.download_from_sra,
+            'ENA': self.download_from_ena,
+            'GEO': self.download_from_geo,
+        }
+    
+    def _build_session(self) -> requests.Session:
+        """Build a pooled keep-alive HTTP session shared by all download workers"""
+        session = requests.Session()
+        # No adapter retries: their backoff would sleep inside the host slot. 5xx responses
+        # raise in raise_for_status and are retried by the download loops after _backoff
+        adapter = HTTPAdapter(
+            pool_connections=self.net_workers,
+            pool_maxsize=self.net_workers * 4,
+            max_retries=0
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def _stream_to_file(self, url: str, destination: Path, expected_md5: Optional[str] = None) -> int:
+        """Stream a URL to disk over the pooled session, hashing bytes as they arrive"""
+        bytes_written = 0
+        hash_obj = self._new_hasher(INTERNAL_CHECKSUM)
+        md5_obj = hashlib.md5() if expected_md5 else None
+        # Write to a partial file so verify_downloads never sees an incomplete FASTQ
+        partial_path = f"{destination}.part"
+        buffer = self._network_buffer()
+        view = memoryview(buffer)
+        with self.session.get(url, stream=True, timeout=(10, 600)) as response:
+            response.raise_for_status()
+            # Read straight into the reusable buffer; keep iter_content's Content-Encoding handling
+            response.raw.decode_content = True
+            # 8 MiB write buffer coalesces four 2 MiB reads per write() syscall
+            with open(partial_path, 'wb', buffering=8 << 20) as fh:
+                while True:
+                    n = response.raw.readinto(buffer)
+                    if not n:
+                        break
+                    chunk = view[:n]
+                    fh.write(chunk)
+                    hash_obj.update(chunk)
+                    if md5_obj is not None:
+                        md5_obj.update(chunk)
+                    bytes_written += n
+                
+                # Flush to disk and evict the written pages so concurrent workers keep the RAM
+                fh.flush()
+                os.fsync(fh.fileno())
+                self._drop_page_cache(fh.fileno())
+        
+        if md5_obj is not None and md5_obj.hexdigest() != expected_md5:
+            os.remove(partial_path)
+            raise IOError(f"MD5 mismatch for {destination.name}: expected {expected_md5}, got {md5_obj.hexdigest()}")
+        
+        # The partial file sits beside the destination, so this is a same-directory rename
+        os.replace(partial_path, destination)
+        self.stream_checksums[str(destination)] = hash_obj.hexdigest()
+        return bytes_written
+    
+    def _network_buffer(self):
+        """Return this thread's 2 MiB download buffer, backed by huge pages where possible"""
+        buffer = getattr(self._thread_local, 'net_buffer', None)
+        if buffer is None:
+            try:
+                # Anonymous mappings are page-aligned; ask for transparent huge pages
+                buffer = mmap.mmap(-1, 2 << 20, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+                if hasattr(mmap, 'MADV_HUGEPAGE'):
+                    buffer.madvise(mmap.MADV_HUGEPAGE)
+            except (OSError, AttributeError, ValueError):
+                buffer = bytearray(2 << 20)
+            self._thread_local.net_buffer = buffer
+        return buffer
+    
+    @staticmethod
+    def _new_hasher(algorithm: str):
+        """Create a hash object, using xxhash for xxh3 and hashlib otherwise"""
+        if algorithm == 'xxh3_64':
+            return xxhash.xxh3_64()
+        return hashlib.new(algorithm)
+    
+    def _pin_cpu_worker(self):
+        """Pin the calling verification thread to one core (Linux only)
+        
+        Keeps the hash state and the pages it touches on one core/NUMA node,
+        relying on first-touch allocation for memory locality.
+        """
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+        
+        allowed_cpus = sorted(os.sched_getaffinity(0))
+        worker_id = next(self._cpu_worker_ids)
+        try:
+            # pid 0 targets the calling thread only
+            os.sched_setaffinity(0, {allowed_cpus[worker_id % len(allowed_cpus)]})
+        except OSError as e:
+            logger.debug(f"Could not pin verification worker {worker_id}: {e}")
+    
+    @contextmanager
+    def _host_slot(self, database: str):
+        """Hold a rate-limited per-server slot for the duration of one attempt"""
+        self.rate_limiters[database].acquire()
+        with self.host_semaphores[database]:
+            yield
+    
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Exponential backoff with jitter so retries do not synchronize"""
+        return 2 ** attempt + random.uniform(0, 1)
+    
+    @staticmethod
+    def _drop_page_cache(fd: int):
+        """Advise the kernel to drop cached pages for a file (no-op where unsupported)"""
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    
+    def preflight_ena_accessions(self, accessions: List[str], batch_size: int = 500) -> Dict:
+        """Resolve FASTQ URLs and official MD5s for ENA runs with batched filereport calls"""
+        logger.info(f"Preflighting {len(accessions)} ENA accessions via filereport")
+        
+        filereport_url = "https://www.ebi.ac.uk/ena/portal/api/filereport"
+        
+        for start in range(0, len(accessions), batch_size):
+            batch = accessions[start:start + batch_size]
+            try:
+                response = self.session.post(filereport_url, data={
+                    'accession': ','.join(batch),
+                    'result': 'read_run',
+                    'fields': 'run_accession,fastq_ftp,fastq_md5,fastq_bytes',
+                    'format': 'tsv'
+                }, timeout=(10, 120))
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logger.warning(f"ENA filereport preflight failed for batch at {start}: {e}")
+                continue
+            
+            lines = response.text.splitlines()
+            if not lines:
+                continue
+            
+            header = lines[0].split('\t')
+            for line in lines[1:]:
+                fields = dict(zip(header, line.split('\t')))
+                if not fields.get('fastq_ftp'):
+                    continue
+                
+                urls = [f"https://{path}" for path in fields['fastq_ftp'].split(';')]
+                md5s = fields.get('fastq_md5', '').split(';')
+                sizes = [int(size) if size.isdigit() else 0 for size in fields.get('fastq_bytes', '').split(';')]
+                self.ena_manifest[fields['run_accession']] = list(zip(urls, md5s, sizes))
+        
+        missing = set(accessions) - set(self.ena_manifest)
+        if missing:
+            logger.warning(f"{len(missing)} ENA accessions have no FASTQ files in filereport")
+        
+        return self.ena_manifest
     
     def create_directory_structure(self):
         """Create organized directory structure by cancer type"""
         logger.info("Creating directory structure...")
         
-        cancer_types = self.metadata_df['cancer_type'].dropna().unique()
+        cancer_types = pd.Series(self.metadata_df['cancer_type'].dropna().unique())
         
-        for cancer_type in cancer_types:
-            # Skip NaN or non-string values
-            if not isinstance(cancer_type, str):
-                logger.warning(f"Skipping invalid cancer type: {cancer_type} (type: {type(cancer_type)})")
-                continue
-            
+        # Skip non-string values in one vectorized pass
+        is_valid = cancer_types.map(type).eq(str)
+        for cancer_type in cancer_types[~is_valid]:
+            logger.warning(f"Skipping invalid cancer type: {cancer_type} (type: {type(cancer_type)})")
+        
+        for cancer_type in cancer_types[is_valid]:
             cancer_dir = self.output_dir / str(cancer_type)
             cancer_dir.mkdir(parents=True, exist_ok=True)
             
@@ -61,86 +274,157 @@ class FASTQDownloadOrchestrator:
             
             logger.info(f"Created directory structure for {cancer_type}")
     
+    def _fasterq_dump_cmd(self, run_accession: str, output_path: Path) -> List[str]:
+        """Build fasterq-dump command, staging temp files on tmpfs when available"""
+        shm_dir = Path('/dev/shm')
+        temp_dir = shm_dir / 'sra_tmp' if shm_dir.is_dir() else output_path / 'sra_tmp'
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        
+        return [
+            'fasterq-dump',
+            '--threads', str(self.fasterq_threads),
+            '--split-3',
+            '--temp', str(temp_dir),
+            '-O', str(output_path),
+            run_accession,
+        ]
+    
+    def _compress_fastq(self, run_accession: str, output_path: Path):
+        """Compress fasterq-dump output in place with pigz (gzip if pigz is missing)"""
+        fastq_files = [str(f) for f in sorted(output_path.glob(f"{run_accession}*.fastq"))]
+        if not fastq_files:
+            return
+        
+        with self._compress_slots:
+            try:
+                subprocess.run(['pigz', '-p', '4'] + fastq_files, check=True, timeout=3600)
+            except FileNotFoundError:
+                logger.warning("pigz not found, falling back to gzip. Install with: conda install -c conda-forge pigz")
+                subprocess.run(['gzip'] + fastq_files, check=True, timeout=3600)
+    
     def download_from_sra(self, run_accession: str, output_path: Path, 
                          max_retries: int = 3) -> Tuple[bool, str]:
-        """Download FASTQ from SRA using parallel-fastq-dump"""
-        logger.info(f"Downloading SRA run: {run_accession}")
+        """Download FASTQ from SRA using fasterq-dump (parallel-fastq-dump as fallback)"""
+        logger.debug(f"Downloading SRA run: {run_accession}")
+        
+        use_fasterq = shutil.which('fasterq-dump') is not None
         
         for attempt in range(max_retries):
             try:
-                # Use parallel-fastq-dump for faster downloads
-                cmd = [
-                    'parallel-fastq-dump',
-                    '--sra-id', run_accession,
-                    '--outdir', str(output_path),
-                    '--split-files',
-                    '--gzip',
-                    '--threads', '4',
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=3600)
+                with self._host_slot('SRA'):
+                    if use_fasterq:
+                        # fasterq-dump decompresses SRA pages in parallel and writes plain FASTQ
+                        cmd = self._fasterq_dump_cmd(run_accession, output_path)
+                    else:
+                        cmd = [
+                            'parallel-fastq-dump',
+                            '--sra-id', run_accession,
+                            '--outdir', str(output_path),
+                            '--split-files',
+                            '--gzip',
+                            '--threads', '4',
+                        ]
+                    
+                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=3600)
                 
+                # Compression is CPU-bound, so the SRA slot is released before it starts
                 if result.returncode == 0:
-                    logger.info(f"Successfully downloaded {run_accession}")
+                    if use_fasterq:
+                        self._compress_fastq(run_accession, output_path)
+                    logger.debug(f"Successfully downloaded {run_accession}")
                     return True, f"Downloaded {run_accession}"
                 else:
                     logger.warning(f"Attempt {attempt + 1} failed for {run_accession}: {result.stderr}")
-                    
+                
             except subprocess.TimeoutExpired:
                 logger.error(f"Timeout downloading {run_accession}")
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Compression failed for {run_accession}: {e}")
             except FileNotFoundError:
-                logger.error("parallel-fastq-dump not found. Install with: conda install -c bioconda parallel-fastq-dump")
-                return False, "parallel-fastq-dump not installed"
+                logger.error("SRA Toolkit not found. Install with: conda install -c bioconda sra-tools")
+                return False, "fasterq-dump/parallel-fastq-dump not installed"
             except Exception as e:
                 logger.error(f"Error downloading {run_accession}: {e}")
             
             if attempt < max_retries - 1:
-                wait_time = 2 ** attempt  # Exponential backoff
-                logger.info(f"Retrying in {wait_time} seconds...")
+                wait_time = self._backoff(attempt)  # Slot is released while we wait
+                logger.debug(f"Retrying in {wait_time:.1f} seconds...")
                 time.sleep(wait_time)
         
         return False, f"Failed to download {run_accession} after {max_retries} attempts"
     
+    @staticmethod
+    def _ena_fastq_filenames(run_accession: str, seq_type: str) -> List[str]:
+        """Predict ENA FASTQ filenames from the run accession and library layout"""
+        if seq_type == 'paired-end':
+            return [f"{run_accession}_1.fastq.gz", f"{run_accession}_2.fastq.gz"]
+        if seq_type == 'single-end':
+            return [f"{run_accession}.fastq.gz"]
+        return []
+    
     def download_from_ena(self, run_accession: str, output_path: Path,
-                         max_retries: int = 3) -> Tuple[bool, str]:
-        """Download FASTQ from ENA FTP"""
-        logger.info(f"Downloading ENA run: {run_accession}")
+                         max_retries: int = 3, seq_type: Optional[str] = None) -> Tuple[bool, str]:
+        """Download FASTQ from ENA over the HTTPS mirror of the FTP tree"""
+        logger.debug(f"Downloading ENA run: {run_accession}")
         
-        # ENA FTP URL pattern
-        ena_ftp_base = "ftp://ftp.sra.ebi.ac.uk/vol1/fastq"
+        # ENA HTTPS mirror of ftp://ftp.sra.ebi.ac.uk/vol1/fastq
+        ena_https_base = "https://ftp.sra.ebi.ac.uk/vol1/fastq"
         
-        # Construct ENA FTP path
+        # Construct ENA run directory URL; runs with more than six digits are
+        # nested under a zero-padded subdirectory of their trailing digits
         run_prefix = run_accession[:6]
-        ena_ftp_path = f"{ena_ftp_base}/{run_prefix}/{run_accession}"
+        if len(run_accession) > 9:
+            ena_run_url = f"{ena_https_base}/{run_prefix}/{run_accession[9:].zfill(3)}/{run_accession}/"
+        else:
+            ena_run_url = f"{ena_https_base}/{run_prefix}/{run_accession}/"
+        
+        # Sample directories are named after the sequencing type
+        predicted_filenames = self._ena_fastq_filenames(run_accession, seq_type or output_path.name)
         
         for attempt in range(max_retries):
             try:
-                # Use wget for FTP downloads
-                cmd = [
-                    'wget',
-                    '-r',
-                    '-nd',
-                    '-P', str(output_path),
-                    '--accept', '*.fastq.gz',
-                    ena_ftp_path
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=3600)
-                
-                if result.returncode == 0:
-                    logger.info(f"Successfully downloaded {run_accession} from ENA")
-                    return True, f"Downloaded {run_accession} from ENA"
-                else:
-                    logger.warning(f"Attempt {attempt + 1} failed for {run_accession}: {result.stderr}")
+                with self._host_slot('ENA'):
+                    manifest = self.ena_manifest.get(run_accession)
+                    if manifest:
+                        # URLs and MD5s were resolved up front by preflight_ena_accessions
+                        for url, md5, _ in manifest:
+                            self._stream_to_file(url, output_path / url.rsplit('/', 1)[-1], expected_md5=md5 or None)
+                        logger.debug(f"Successfully downloaded {run_accession} from ENA")
+                        return True, f"Downloaded {run_accession} from ENA"
                     
-            except subprocess.TimeoutExpired:
-                logger.error(f"Timeout downloading {run_accession} from ENA")
+                    if predicted_filenames:
+                        # Filenames are deterministic, so skip the directory listing round-trip
+                        try:
+                            for filename in predicted_filenames:
+                                self._stream_to_file(urljoin(ena_run_url, filename), output_path / filename)
+                            logger.debug(f"Successfully downloaded {run_accession} from ENA")
+                            return True, f"Downloaded {run_accession} from ENA"
+                        except requests.HTTPError as e:
+                            if e.response is None or e.response.status_code != 404:
+                                raise
+                            logger.debug(f"Predicted filenames not found for {run_accession}, listing run directory")
+                    
+                    # Discover FASTQ filenames with a single directory listing request
+                    listing = self.session.get(ena_run_url, timeout=(10, 60))
+                    listing.raise_for_status()
+                    filenames = sorted(set(re.findall(r'href="([^"/]+\.fastq\.gz)"', listing.text)))
+                    
+                    if not filenames:
+                        logger.warning(f"Attempt {attempt + 1} failed for {run_accession}: no FASTQ files listed")
+                    else:
+                        for filename in filenames:
+                            self._stream_to_file(urljoin(ena_run_url, filename), output_path / filename)
+                        logger.debug(f"Successfully downloaded {run_accession} from ENA")
+                        return True, f"Downloaded {run_accession} from ENA"
+                    
+            except requests.RequestException as e:
+                logger.warning(f"Attempt {attempt + 1} failed for {run_accession}: {e}")
             except Exception as e:
                 logger.error(f"Error downloading {run_accession} from ENA: {e}")
             
             if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                logger.info(f"Retrying in {wait_time} seconds...")
+                wait_time = self._backoff(attempt)
+                logger.debug(f"Retrying in {wait_time:.1f} seconds...")
                 time.sleep(wait_time)
         
         return False, f"Failed to download {run_accession} from ENA after {max_retries} attempts"
@@ -148,87 +432,130 @@ class FASTQDownloadOrchestrator:
     def download_from_geo(self, geo_accession: str, output_path: Path,
                          max_retries: int = 3) -> Tuple[bool, str]:
         """Download supplementary files from GEO"""
-        logger.info(f"Downloading GEO dataset: {geo_accession}")
+        logger.debug(f"Downloading GEO dataset: {geo_accession}")
         
         geo_url = f"https://www.ncbi.nlm.nih.gov/geo/download/?acc={geo_accession}&format=file"
         
         for attempt in range(max_retries):
             try:
-                cmd = [
-                    'wget',
-                    '-P', str(output_path),
-                    geo_url
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=3600)
-                
-                if result.returncode == 0:
-                    logger.info(f"Successfully downloaded {geo_accession} from GEO")
+                with self._host_slot('GEO'):
+                    self._stream_to_file(geo_url, output_path / f"{geo_accession}_RAW.tar")
+                    logger.debug(f"Successfully downloaded {geo_accession} from GEO")
                     return True, f"Downloaded {geo_accession} from GEO"
-                else:
-                    logger.warning(f"Attempt {attempt + 1} failed for {geo_accession}")
                     
+            except requests.RequestException as e:
+                logger.warning(f"Attempt {attempt + 1} failed for {geo_accession}: {e}")
             except Exception as e:
                 logger.error(f"Error downloading {geo_accession}: {e}")
             
             if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
+                wait_time = self._backoff(attempt)
                 time.sleep(wait_time)
         
         return False, f"Failed to download {geo_accession} after {max_retries} attempts"
     
-    def calculate_checksum(self, file_path: Path, algorithm: str = 'md5') -> str:
-        """Calculate file checksum"""
-        hash_obj = hashlib.new(algorithm)
-        
+    def calculate_checksum(self, file_path: Union[str, Path], algorithm: Optional[str] = None) -> str:
+        """Calculate file checksum (xxh3 by default, SHA-256 if xxhash is not installed)"""
+        algorithm = algorithm or INTERNAL_CHECKSUM
         with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                hash_obj.update(chunk)
+            # Drop any pages cached from the write so the hash reflects what is on disk
+            self._drop_page_cache(f.fileno())
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            
+            # Python 3.11+ hashes hashlib digests inside the C layer without a Python-level loop
+            if hasattr(hashlib, 'file_digest') and algorithm in hashlib.algorithms_available:
+                digest = hashlib.file_digest(f, algorithm).hexdigest()
+            else:
+                buffer = getattr(self._thread_local, 'buffer', None)
+                if buffer is None:
+                    buffer = self._thread_local.buffer = bytearray(1 << 20)
+                view = memoryview(buffer)
+                
+                hash_obj = self._new_hasher(algorithm)
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    hash_obj.update(view[:n])
+                digest = hash_obj.hexdigest()
+            
+            # Verified pages will not be reused; release them
+            self._drop_page_cache(f.fileno())
         
-        return hash_obj.hexdigest()
+        return digest
     
-    def verify_downloads(self, output_path: Path) -> Dict[str, bool]:
+    def verify_downloads(self, output_path: Path) -> Dict[str, Dict]:
         """Verify downloaded FASTQ files"""
-        logger.info(f"Verifying downloads in {output_path}")
+        logger.debug(f"Verifying downloads in {output_path}")
         
         verification_results = {}
         
-        for fastq_file in output_path.glob('*.fastq.gz'):
-            try:
-                # Check file size (should be > 0)
-                file_size = fastq_file.stat().st_size
+        # scandir reuses the readdir data and avoids a Path object per entry
+        with os.scandir(output_path) as entries:
+            for entry in entries:
+                name = entry.name
+                if not name.endswith('.fastq.gz'):
+                    continue
                 
-                if file_size > 0:
-                    # Calculate checksum
-                    checksum = self.calculate_checksum(fastq_file)
-                    verification_results[fastq_file.name] = {
-                        'status': 'pass',
-                        'size': file_size,
-                        'checksum': checksum
-                    }
-                    logger.info(f"Verified {fastq_file.name}: {file_size} bytes")
-                else:
-                    verification_results[fastq_file.name] = {
+                try:
+                    # Check file size (should be > 0)
+                    file_size = entry.stat().st_size
+                    
+                    if file_size > 0:
+                        # Reuse the digest from the streaming download; only re-read files
+                        # written by external tools (e.g. parallel-fastq-dump)
+                        checksum = self.stream_checksums.get(entry.path)
+                        if checksum is None:
+                            checksum = self.calculate_checksum(entry.path)
+                        verification_results[name] = {
+                            'status': 'pass',
+                            'size': file_size,
+                            'checksum': checksum,
+                            'algorithm': INTERNAL_CHECKSUM
+                        }
+                        logger.debug(f"Verified {name}: {file_size} bytes")
+                    else:
+                        verification_results[name] = {
+                            'status': 'fail',
+                            'reason': 'empty_file'
+                        }
+                        logger.warning(f"Empty file: {name}")
+                        
+                except Exception as e:
+                    verification_results[name] = {
                         'status': 'fail',
-                        'reason': 'empty_file'
+                        'reason': str(e)
                     }
-                    logger.warning(f"Empty file: {fastq_file.name}")
-                    
-            except Exception as e:
-                verification_results[fastq_file.name] = {
-                    'status': 'fail',
-                    'reason': str(e)
-                }
-                logger.error(f"Error verifying {fastq_file.name}: {e}")
+                    logger.error(f"Error verifying {name}: {e}")
         
         return verification_results
     
-    def download_sample(self, row: pd.Series) -> Dict:
-        """Download a single sample"""
-        database = row['database']
-        accession = row['accession']
-        cancer_type = row['cancer_type']
-        seq_type = row.get('sequencing_type', 'unknown')
+    def _allocate_download_log(self, records: List[Dict]):
+        """Preallocate the columnar download log; each worker writes only its own row"""
+        n = len(records)
+        self.download_log = {
+            'accession': np.array([r['accession'] for r in records], dtype=object),
+            'database': np.array([r['database'] for r in records], dtype=object),
+            'cancer_type': np.array([r['cancer_type'] for r in records], dtype=object),
+            'success': np.zeros(n, dtype=bool),
+            'message': np.full(n, 'not attempted', dtype=object),
+        }
+    
+    @property
+    def failed_downloads(self) -> pd.DataFrame:
+        """Rows of the download log that did not succeed"""
+        if not self.download_log:
+            return pd.DataFrame(columns=['accession', 'database', 'cancer_type', 'success', 'message'])
+        log_df = pd.DataFrame(self.download_log)
+        return log_df[~log_df['success']]
+    
+    def download_sample(self, record: Dict[str, str], row: Optional[int] = None) -> Dict:
+        """Download a single sample (network pool)"""
+        database = record['database']
+        accession = record['accession']
+        cancer_type = record['cancer_type']
+        seq_type = record['sequencing_type']
         
         # Determine output directory
         output_path = self.output_dir / cancer_type / seq_type
@@ -239,12 +566,9 @@ class FASTQDownloadOrchestrator:
         message = ""
         
         try:
-            if database == 'SRA':
-                success, message = self.download_from_sra(accession, output_path)
-            elif database == 'ENA':
-                success, message = self.download_from_ena(accession, output_path)
-            elif database == 'GEO':
-                success, message = self.download_from_geo(accession, output_path)
+            handler = self._dispatch.get(database)
+            if handler is not None:
+                success, message = handler(accession, output_path)
             else:
                 message = f"Unknown database: {database}"
         
@@ -252,61 +576,90 @@ class FASTQDownloadOrchestrator:
             success = False
             message = str(e)
         
-        # Verify downloads
-        verification = self.verify_downloads(output_path) if success else {}
-        
-        result = {
+        return {
+            'row': row,
             'accession': accession,
-            'database': database,
-            'cancer_type': cancer_type,
             'success': success,
             'message': message,
-            'verification': verification
+            'output_path': output_path
         }
+    
+    def verify_sample(self, result: Dict) -> Dict:
+        """Verify a downloaded sample and record its outcome (CPU pool)"""
+        output_path = result.pop('output_path')
         
-        if not success:
-            self.failed_downloads.append(result)
+        if result['success']:
+            self.verification[result['accession']] = self.verify_downloads(output_path)
         
-        self.download_log.append(result)
+        row = result['row']
+        if row is not None and self.download_log:
+            self.download_log['success'][row] = result['success']
+            self.download_log['message'][row] = result['message']
         return result
     
-    def orchestrate_downloads(self, sample_limit: int = None):
+    def orchestrate_downloads(self, sample_limit: Optional[int] = None):
         """Orchestrate parallel downloads"""
-        logger.info(f"Starting download orchestration with {self.max_workers} workers")
+        logger.info(f"Starting download orchestration with {self.net_workers} network "
+                    f"and {self.cpu_workers} verification workers")
         
         # Create directory structure
         self.create_directory_structure()
         
-        # Prepare download queue
-        download_queue = self.metadata_df.copy()
-        
-        if sample_limit:
-            download_queue = download_queue.head(sample_limit)
-        
-        logger.info(f"Queued {len(download_queue)} samples for download")
-        
-        # Execute parallel downloads
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = {
-                executor.submit(self.download_sample, row): idx
-                for idx, (_, row) in enumerate(download_queue.iterrows())
-            }
+        # Prepare download queue as a view; only the four needed columns are materialized
+        download_queue = self.metadata_df.head(sample_limit) if sample_limit else self.metadata_df
+        
+        # Materialize plain dicts once instead of building a Series per row
+        records = (
+            download_queue
+            .reindex(columns=['database', 'accession', 'cancer_type', 'sequencing_type'])
+            .fillna({'sequencing_type': 'unknown'})
+            .to_dict('records')
+        )
+        del download_queue
+        
+        logger.info(f"Queued {len(records)} samples for download")
+        
+        self._allocate_download_log(records)
+        
+        # Resolve all ENA file URLs and MD5s in batched requests rather than per sample
+        ena_accessions = [r['accession'] for r in records if r['database'] == 'ENA']
+        if ena_accessions:
+            self.preflight_ena_accessions(ena_accessions)
+        
+        # Execute parallel downloads, handing each finished download to the verification pool
+        with ThreadPoolExecutor(max_workers=self.net_workers) as net_pool, \
+                ThreadPoolExecutor(max_workers=self.cpu_workers,
+                                   initializer=self._pin_cpu_worker) as cpu_pool:
+            download_futures = [
+                net_pool.submit(self.download_sample, record, row)
+                for row, record in enumerate(records)
+            ]
+            
+            verify_futures = []
+            for future in as_completed(download_futures):
+                try:
+                    verify_futures.append(cpu_pool.submit(self.verify_sample, future.result()))
+                except Exception as e:
+                    logger.error(f"Error in download task: {e}")
             
             completed = 0
-            for future in as_completed(futures):
+            for future in as_completed(verify_futures):
                 try:
                     result = future.result()
                     completed += 1
                     status = "✓" if result['success'] else "✗"
-                    logger.info(f"[{completed}/{len(download_queue)}] {status} {result['accession']}")
+                    # Single per-sample event; per-attempt detail is logged at DEBUG
+                    logger.info(f"[{completed}/{len(records)}] {status} {result['accession']}: {result['message']}")
                 except Exception as e:
-                    logger.error(f"Error in download task: {e}")
+                    logger.error(f"Error in verification task: {e}")
         
-        logger.info(f"Download orchestration complete. {len(self.download_log)} total, {len(self.failed_downloads)} failed")
+        logger.info(f"Download orchestration complete. {len(records)} total, {len(self.failed_downloads)} failed")
     
     def save_download_report(self, output_file: str = 'download_report.csv'):
         """Save download report"""
         report_df = pd.DataFrame(self.download_log)
+        if not report_df.empty:
+            report_df['verification'] = report_df['accession'].map(lambda acc: self.verification.get(acc, {}))
         report_df.to_csv(output_file, index=False)
         logger.info(f"Download report saved to {output_file}")
         
@@ -318,10 +671,10 @@ class FASTQDownloadOrchestrator:
             f.write("Failed Downloads - Retry List\n")
             f.write("=" * 50 + "\n\n")
             
-            for item in self.failed_downloads:
-                f.write(f"Accession: {item['accession']}\n")
-                f.write(f"Database: {item['database']}\n")
-                f.write(f"Message: {item['message']}\n")
+            for item in self.failed_downloads.itertuples(index=False):
+                f.write(f"Accession: {item.accession}\n")
+                f.write(f"Database: {item.database}\n")
+                f.write(f"Message: {item.message}\n")
                 f.write("-" * 50 + "\n")
         
         logger.info(f"Failed downloads list saved to {output_file}")
@@ -334,7 +687,8 @@ def main():
     orchestrator = FASTQDownloadOrchestrator(
         metadata_file='consolidated_metadata.csv',
         output_dir='fastq_downloads',
-        max_workers=4
+        net_workers=32,
+        cpu_workers=os.cpu_count()
     )
     
     # Start downloads (limit to 10 for testing)
@@ -355,6 +709,6 @@ if __name__ == "__main__":
     print("\n" + "=" * 60)
     print("DOWNLOAD SUMMARY")
     print("=" * 60)
-    print(f"Total downloads: {len(orchestrator.download_log)}")
-    print(f"Successful: {sum(1 for d in orchestrator.download_log if d['success'])}")
+    print(f"Total downloads: {len(orchestrator.download_log.get('success', []))}")
+    print(f"Successful: {int(orchestrator.download_log.get('success', np.zeros(0, dtype=bool)).sum())}")
     print(f"Failed: {len(orchestrator.failed_downloads)}")
\ No newline at end of file
@@ -4,14 +4,33 @@ FastQC Quality Control Pipeline
 Generates FastQC reports, MultiQC aggregation, and quality metrics for all FASTQ files
 """
 
+import asyncio
+import os
 import subprocess
 import pandas as pd
+import numpy as np
 import json
 import logging
+import mmap
+import re
+import shutil
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Dict, List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import re
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+import zipfile
+# Prefer ISA-L's igzip for in-process decompression, else stdlib gzip
+try:
+    from isal import igzip as fastq_gzip
+except ImportError:
+    import gzip as fastq_gzip
+# Use orjson for fastp reports if available, else stdlib json
+try:
+    import orjson
+    decode_json = orjson.loads
+except ImportError:
+    decode_json = json.loads
 
 # Configure logging
 logging.basicConfig(
@@ -24,66 +43,368 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# FastQC module (">>Module\tstatus" line of fastqc_data.txt) -> metrics key
+FASTQC_MODULES = {
+    'Per base sequence quality': 'per_base_quality',
+    'Per sequence quality scores': 'per_sequence_quality',
+    'Adapter Content': 'adapter_content',
+    'Overrepresented sequences': 'overrepresented_sequences',
+}
+# Module header line (">>Name\tstatus") in the raw bytes of fastqc_data.txt
+FASTQC_MODULE_LINE = re.compile(rb'^>>([^\t\r\n]+)\t([^\t\r\n]*)', re.MULTILINE)
+# Basic Statistics measure -> (metrics key, converter)
+FASTQC_MEASURES = {
+    'Total Sequences': ('total_sequences', lambda value: int(value.replace(',', ''))),
+    'Sequence length': ('sequence_length', str),
+    '%GC': ('gc_content', int),
+}
+# fastp (multithreaded, JSON report) is the QC engine when installed, FastQC otherwise
+QC_ENGINE = 'fastp' if shutil.which('fastp') else 'fastqc'
+# fastp Q20 base fraction above which per-base quality passes / warns
+FASTP_Q20_PASS = 0.90
+FASTP_Q20_WARN = 0.80
+# Fraction of reads carrying adapter above which adapter content warns / fails
+FASTP_ADAPTER_WARN = 0.05
+FASTP_ADAPTER_FAIL = 0.10
+# pigz inflates in a separate process, overlapping decompression with validation
+PIGZ = shutil.which('pigz')
+# Decompressed bytes validated per step; lines are located with vectorized newline scans
+FASTQ_BLOCK_SIZE = 1 << 20
+# Most files queued into one FastQC process, amortizing JVM startup
+FASTQC_BATCH_SIZE = 32
+
+class QCBatcher:
+    """Queue validated files and run them through the QC engine in batches as slots free up"""
+    
+    def __init__(self, qc: 'FastQCQualityControl', output_dir: Path, slots: asyncio.Semaphore,
+                 batch_size: int = FASTQC_BATCH_SIZE):
+        self.qc = qc
+        self.output_dir = output_dir
+        self.slots = slots
+        self.batch_size = batch_size
+        self._pending = []
+    
+    async def run(self, fastq_file: Path) -> Tuple[bool, str]:
+        """QC result for one file, which may be run together with other queued files"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((fastq_file, future))
+        
+        # Whoever holds a free slot runs the oldest queued files, so files queue up only
+        # while every slot is busy; a file already taken by another run waits for it
+        while not future.done() and self._pending:
+            async with self.slots:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                if batch:
+                    await self._run_batch(batch)
+        
+        return await future
+    
+    async def _run_batch(self, batch: List[Tuple[Path, asyncio.Future]]):
+        """Run one batch and hand each file's result to its waiter"""
+        results = [(False, "QC run interrupted")] * len(batch)
+        try:
+            results = await self.qc.run_qc_batch_async([fastq_file for fastq_file, _ in batch], self.output_dir)
+        finally:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
 class FastQCQualityControl:
     """Execute FastQC and quality control analysis"""
     
+    # QC engine -> (tool name, install command)
+    QC_TOOLS = {
+        'fastqc': ('FastQC', 'conda install -c bioconda fastqc'),
+        'fastp': ('fastp', 'conda install -c bioconda fastp'),
+    }
+    
+    # qc_summary.csv status column -> metrics key
+    SUMMARY_STATUS_COLUMNS = (
+        ('per_base_quality', 'per_base_quality'),
+        ('per_sequence_quality', 'per_sequence_quality'),
+        ('adapter_content', 'adapter_content'),
+        ('overall_status', 'status'),
+    )
+    
     def __init__(self, fastq_dir: str = 'fastq_downloads',
                  output_dir: str = 'qc_reports',
-                 max_workers: int = 4):
+                 max_workers: int = 4,
+                 fastqc_concurrency: int = None,
+                 engine: str = QC_ENGINE):
+        if engine not in self.QC_TOOLS:
+            raise ValueError(f"Unknown QC engine: {engine}")
+        
         self.fastq_dir = Path(fastq_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.max_workers = max_workers
+        self.engine = engine
+        # Created once here rather than per file by the workers
+        self.report_dir = self.output_dir / f'{engine}_reports'
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        # QC tool runs are external processes using 2 threads each, so they are limited
+        # separately from the validation workers; by default they fill the CPUs
+        self.fastqc_concurrency = fastqc_concurrency or max(1, (os.cpu_count() or 2) // 2)
         self.qc_results = []
         self.failed_qc = []
     
+    def __getstate__(self):
+        # Worker processes only need the configuration, not the results collected so far
+        state = self.__dict__.copy()
+        state['qc_results'] = []
+        state['failed_qc'] = []
+        return state
+    
     def find_fastq_files(self) -> List[Path]:
         """Find all FASTQ files in directory"""
         logger.info(f"Searching for FASTQ files in {self.fastq_dir}")
         
-        fastq_files = list(self.fastq_dir.rglob('*.fastq.gz'))
+        # Walk with scandir: entry types come from the directory listing, so no
+        # per-entry stat or Path is needed until a FASTQ file matches
+        fastq_files = []
+        pending = [str(self.fastq_dir)]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.endswith('.fastq.gz'):
+                            fastq_files.append(Path(entry.path))
+            except OSError:
+                # Missing or unreadable directories are skipped, as rglob did
+                continue
+        
         logger.info(f"Found {len(fastq_files)} FASTQ files")
         
         return fastq_files
     
-    def run_fastqc(self, fastq_file: Path, output_dir: Path) -> Tuple[bool, str]:
-        """Run FastQC on a single FASTQ file"""
-        logger.info(f"Running FastQC on {fastq_file.name}")
+    @staticmethod
+    def _fastqc_command(fastq_file: Path, output_dir: Path) -> List[str]:
+        """FastQC command line for one FASTQ file"""
+        return FastQCQualityControl._fastqc_batch_command([fastq_file], output_dir)
+    
+    @staticmethod
+    def _fastqc_batch_command(fastq_files: List[Path], output_dir: Path) -> List[str]:
+        """FastQC command line for several FASTQ files in one JVM"""
+        return [
+            'fastqc',
+            '--outdir', str(output_dir),
+            '--threads', '2',
+            '--nogroup',
+            *map(str, fastq_files)
+        ]
+    
+    @staticmethod
+    def _fastp_command(fastq_file: Path, output_dir: Path) -> List[str]:
+        """fastp command line that only reports: adapter trimming stays on so adapters are
+        counted, but without -o/--out1 no reads are written and nothing is filtered"""
+        json_report = FastQCQualityControl._fastp_report(fastq_file, output_dir)
+        return [
+            'fastp',
+            '--disable_quality_filtering',
+            '-i', str(fastq_file),
+            '-j', str(json_report),
+            '-h', str(json_report.with_suffix('.html')),
+            '-w', '2'
+        ]
+    
+    def _qc_command(self, fastq_file: Path, output_dir: Path) -> List[str]:
+        """Command line of the configured QC engine"""
+        if self.engine == 'fastp':
+            return self._fastp_command(fastq_file, output_dir)
+        return self._fastqc_command(fastq_file, output_dir)
+    
+    def _run_qc_command(self, engine: str, cmd: List[str], fastq_file: Path) -> Tuple[bool, str]:
+        """Run one QC tool command on a single FASTQ file"""
+        tool, install = self.QC_TOOLS[engine]
+        logger.info(f"Running {tool} on {fastq_file.name}")
         
         try:
-            cmd = [
-                'fastqc',
-                '--outdir', str(output_dir),
-                '--threads', '2',
-                '--nogroup',
-                str(fastq_file)
-            ]
-            
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
             
             if result.returncode == 0:
-                logger.info(f"FastQC completed for {fastq_file.name}")
-                return True, f"FastQC completed for {fastq_file.name}"
+                logger.info(f"{tool} completed for {fastq_file.name}")
+                return True, f"{tool} completed for {fastq_file.name}"
             else:
-                logger.error(f"FastQC failed for {fastq_file.name}: {result.stderr}")
+                logger.error(f"{tool} failed for {fastq_file.name}: {result.stderr}")
                 return False, result.stderr
                 
         except FileNotFoundError:
-            logger.error("FastQC not found. Install with: conda install -c bioconda fastqc")
-            return False, "FastQC not installed"
+            logger.error(f"{tool} not found. Install with: {install}")
+            return False, f"{tool} not installed"
         except subprocess.TimeoutExpired:
-            logger.error(f"FastQC timeout for {fastq_file.name}")
+            logger.error(f"{tool} timeout for {fastq_file.name}")
             return False, "Timeout"
         except Exception as e:
-            logger.error(f"Error running FastQC: {e}")
+            logger.error(f"Error running {tool}: {e}")
             return False, str(e)
     
-    def extract_fastqc_metrics(self, fastqc_html: Path) -> Dict:
-        """Extract key metrics from FastQC HTML report"""
-        logger.info(f"Extracting metrics from {fastqc_html.name}")
+    def run_fastqc(self, fastq_file: Path, output_dir: Path) -> Tuple[bool, str]:
+        """Run FastQC on a single FASTQ file"""
+        return self._run_qc_command('fastqc', self._fastqc_command(fastq_file, output_dir), fastq_file)
+    
+    def run_fastp(self, fastq_file: Path, output_dir: Path) -> Tuple[bool, str]:
+        """Run fastp on a single FASTQ file; the JSON report is at _fastp_report()"""
+        return self._run_qc_command('fastp', self._fastp_command(fastq_file, output_dir), fastq_file)
+    
+    async def run_qc_async(self, fastq_file: Path, output_dir: Path) -> Tuple[bool, str]:
+        """Run the configured QC engine on a single FASTQ file as an asyncio subprocess"""
+        tool, install = self.QC_TOOLS[self.engine]
+        logger.info(f"Running {tool} on {fastq_file.name}")
+        
+        try:
+            process = await asyncio.create_subprocess_exec(*self._qc_command(fastq_file, output_dir),
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=600)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise
+            
+            if process.returncode == 0:
+                logger.info(f"{tool} completed for {fastq_file.name}")
+                return True, f"{tool} completed for {fastq_file.name}"
+            else:
+                stderr = stderr.decode(errors='replace')
+                logger.error(f"{tool} failed for {fastq_file.name}: {stderr}")
+                return False, stderr
+                
+        except FileNotFoundError:
+            logger.error(f"{tool} not found. Install with: {install}")
+            return False, f"{tool} not installed"
+        except asyncio.TimeoutError:
+            logger.error(f"{tool} timeout for {fastq_file.name}")
+            return False, "Timeout"
+        except Exception as e:
+            logger.error(f"Error running {tool}: {e}")
+            return False, str(e)
+    
+    async def run_fastqc_batch_async(self, fastq_files: List[Path], output_dir: Path) -> List[Tuple[bool, str]]:
+        """Run one FastQC process over several FASTQ files; each succeeded if its report was written"""
+        logger.info(f"Running FastQC on {len(fastq_files)} files: {', '.join(f.name for f in fastq_files)}")
+        
+        # Drop reports from earlier runs so only files analysed now count as successful
+        reports = [self._fastqc_report(fastq_file, output_dir) for fastq_file in fastq_files]
+        for report in reports:
+            report.unlink(missing_ok=True)
+        
+        try:
+            process = await asyncio.create_subprocess_exec(*self._fastqc_batch_command(fastq_files, output_dir),
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=600 * len(fastq_files))
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise
+            stderr = stderr.decode(errors='replace').strip()
+            # A file can fail even when FastQC exits 0 (e.g. it skipped an unreadable input)
+            reason = f"FastQC exited with code {process.returncode}, no report written"
+            if stderr:
+                reason = f"{reason}: {stderr}"
+            
+        except FileNotFoundError:
+            logger.error("FastQC not found. Install with: conda install -c bioconda fastqc")
+            return [(False, "FastQC not installed")] * len(fastq_files)
+        except asyncio.TimeoutError:
+            # Files finished before the timeout keep their reports
+            logger.error(f"FastQC timeout for batch of {len(fastq_files)} files")
+            reason = "Timeout, no report written"
+        except Exception as e:
+            logger.error(f"Error running FastQC: {e}")
+            return [(False, str(e))] * len(fastq_files)
+        
+        results = []
+        for fastq_file, report in zip(fastq_files, reports):
+            if report.exists():
+                logger.info(f"FastQC completed for {fastq_file.name}")
+                results.append((True, f"FastQC completed for {fastq_file.name}"))
+            else:
+                logger.error(f"FastQC failed for {fastq_file.name}: {reason}")
+                results.append((False, reason))
+        return results
+    
+    async def run_qc_batch_async(self, fastq_files: List[Path], output_dir: Path) -> List[Tuple[bool, str]]:
+        """Run the configured QC engine over several files: one FastQC process, or fastp per file"""
+        if self.engine == 'fastqc':
+            return await self.run_fastqc_batch_async(fastq_files, output_dir)
+        return [await self.run_qc_async(fastq_file, output_dir) for fastq_file in fastq_files]
+    
+    @staticmethod
+    def _report_stem(fastq_file: Path) -> str:
+        """Report name stem; like FastQC, strip .gz/.bz2/.txt, then .fastq/.fq"""
+        name = fastq_file.name
+        for suffix in ('.gz', '.bz2', '.txt', '.fastq', '.fq'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        return name
+    
+    @staticmethod
+    def _fastqc_report(fastq_file: Path, output_dir: Path) -> Path:
+        """Zip FastQC writes for a file"""
+        return output_dir / f"{FastQCQualityControl._report_stem(fastq_file)}_fastqc.zip"
+    
+    @staticmethod
+    def _fastp_report(fastq_file: Path, output_dir: Path) -> Path:
+        """JSON report fastp writes for a file"""
+        return output_dir / f"{FastQCQualityControl._report_stem(fastq_file)}_fastp.json"
+    
+    def _qc_report(self, fastq_file: Path, output_dir: Path) -> Path:
+        """Report of the configured QC engine for a file"""
+        if self.engine == 'fastp':
+            return self._fastp_report(fastq_file, output_dir)
+        return self._fastqc_report(fastq_file, output_dir)
+    
+    def extract_qc_metrics(self, qc_report: Path) -> Dict:
+        """Extract key metrics from a report of the configured QC engine"""
+        if self.engine == 'fastp':
+            return self.extract_fastp_metrics(qc_report)
+        return self.extract_fastqc_metrics(qc_report)
+    
+    @staticmethod
+    def _overall_status(metrics: Dict) -> str:
+        """Overall pass/warn/fail from per-base and per-sequence quality"""
+        if metrics['per_base_quality'] == 'fail' or metrics['per_sequence_quality'] == 'fail':
+            return 'fail'
+        elif metrics['per_base_quality'] == 'warn' or metrics['per_sequence_quality'] == 'warn':
+            return 'warn'
+        return 'pass'
+    
+    @staticmethod
+    @contextmanager
+    def _fastqc_data(fastqc_report: Path):
+        """Raw bytes of fastqc_data.txt: memory-mapped from an extracted report directory, else read from the report zip"""
+        name = fastqc_report.name
+        for suffix in ('.zip', '.html'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        
+        data_file = fastqc_report.parent / name / 'fastqc_data.txt'
+        if data_file.exists():
+            with open(data_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    yield b''
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    yield data
+            return
+        
+        with zipfile.ZipFile(fastqc_report.parent / f"{name}.zip") as archive:
+            yield archive.read(f"{name}/fastqc_data.txt")
+    
+    def extract_fastqc_metrics(self, fastqc_report: Path) -> Dict:
+        """Extract key metrics from a FastQC report's fastqc_data.txt (report zip, HTML or directory)"""
+        logger.info(f"Extracting metrics from {fastqc_report.name}")
         
         metrics = {
-            'file': fastqc_html.stem.replace('_fastqc', ''),
+            'file': fastqc_report.name.split('_fastqc')[0],
             'total_sequences': 0,
             'sequence_length': '',
             'gc_content': 0,
@@ -95,67 +416,84 @@ class FastQCQualityControl:
         }
         
         try:
-            with open(fastqc_html, 'r') as f:
-                content = f.read()
-            
-            # Extract total sequences
-            match = re.search(r'Total Sequences</td><td>([0-9,]+)</td>', content)
-            if match:
-                metrics['total_sequences'] = int(match.group(1).replace(',', ''))
-            
-            # Extract sequence length
-            match = re.search(r'Sequence length</td><td>([0-9\-]+)</td>', content)
-            if match:
-                metrics['sequence_length'] = match.group(1)
+            # Modules open with ">>Name\tstatus" and close with ">>END_MODULE"; only
+            # the header lines and the Basic Statistics rows ("Measure\tValue") are
+            # decoded, never the per-position tables in between
+            with self._fastqc_data(fastqc_report) as data:
+                for header in FASTQC_MODULE_LINE.finditer(data):
+                    module = header.group(1).decode()
+                    status = header.group(2).decode()
+                    if module in FASTQC_MODULES:
+                        metrics[FASTQC_MODULES[module]] = status if status in ('pass', 'warn') else 'fail'
+                    elif module == 'Basic Statistics':
+                        end = data.find(b'>>END_MODULE', header.end())
+                        rows = data[header.end():end if end >= 0 else len(data)]
+                        for line in rows.decode().splitlines():
+                            measure, _, value = line.partition('\t')
+                            if measure in FASTQC_MEASURES:
+                                key, convert = FASTQC_MEASURES[measure]
+                                try:
+                                    metrics[key] = convert(value.strip())
+                                except ValueError:
+                                    pass
             
-            # Extract GC content
-            match = re.search(r'%GC</td><td>([0-9]+)</td>', content)
-            if match:
-                metrics['gc_content'] = int(match.group(1))
+            # Determine overall status
+            metrics['status'] = self._overall_status(metrics)
+                
+        except Exception as e:
+            logger.error(f"Error extracting metrics from {fastqc_report}: {e}")
+        
+        return metrics
+    
+    def extract_fastp_metrics(self, fastp_report: Path) -> Dict:
+        """Extract key metrics from a fastp JSON report"""
+        logger.info(f"Extracting metrics from {fastp_report.name}")
+        
+        metrics = {
+            'file': fastp_report.name.split('_fastp')[0],
+            'total_sequences': 0,
+            'sequence_length': '',
+            'gc_content': 0,
+            'per_base_quality': 'unknown',
+            'per_sequence_quality': 'unknown',
+            'adapter_content': 'unknown',
+            'overrepresented_sequences': 'unknown',
+            'status': 'unknown'
+        }
+        
+        try:
+            with open(fastp_report, 'rb') as f:
+                report = decode_json(f.read())
             
-            # Extract status indicators
-            if 'Per base sequence quality' in content:
-                if '<span class="pass">' in content.split('Per base sequence quality')[1].split('</tr>')[0]:
-                    metrics['per_base_quality'] = 'pass'
-                elif '<span class="warn">' in content.split('Per base sequence quality')[1].split('</tr>')[0]:
-                    metrics['per_base_quality'] = 'warn'
-                else:
-                    metrics['per_base_quality'] = 'fail'
+            before = report['summary']['before_filtering']
+            metrics['total_sequences'] = int(before['total_reads'])
+            metrics['sequence_length'] = str(before['read1_mean_length'])
+            metrics['gc_content'] = int(round(before['gc_content'] * 100))
             
-            if 'Per sequence quality scores' in content:
-                if '<span class="pass">' in content.split('Per sequence quality scores')[1].split('</tr>')[0]:
-                    metrics['per_sequence_quality'] = 'pass'
-                elif '<span class="warn">' in content.split('Per sequence quality scores')[1].split('</tr>')[0]:
-                    metrics['per_sequence_quality'] = 'warn'
-                else:
-                    metrics['per_sequence_quality'] = 'fail'
+            q20_rate = before['q20_rate']
+            if q20_rate > FASTP_Q20_PASS:
+                metrics['per_base_quality'] = 'pass'
+            elif q20_rate > FASTP_Q20_WARN:
+                metrics['per_base_quality'] = 'warn'
+            else:
+                metrics['per_base_quality'] = 'fail'
             
-            if 'Adapter Content' in content:
-                if '<span class="pass">' in content.split('Adapter Content')[1].split('</tr>')[0]:
-                    metrics['adapter_content'] = 'pass'
-                elif '<span class="warn">' in content.split('Adapter Content')[1].split('</tr>')[0]:
-                    metrics['adapter_content'] = 'warn'
-                else:
+            # adapter_cutting is written because adapter trimming is left enabled
+            adapter_cutting = report.get('adapter_cutting')
+            if adapter_cutting and metrics['total_sequences']:
+                adapter_rate = adapter_cutting['adapter_trimmed_reads'] / metrics['total_sequences']
+                if adapter_rate > FASTP_ADAPTER_FAIL:
                     metrics['adapter_content'] = 'fail'
-            
-            if 'Overrepresented sequences' in content:
-                if '<span class="pass">' in content.split('Overrepresented sequences')[1].split('</tr>')[0]:
-                    metrics['overrepresented_sequences'] = 'pass'
-                elif '<span class="warn">' in content.split('Overrepresented sequences')[1].split('</tr>')[0]:
-                    metrics['overrepresented_sequences'] = 'warn'
+                elif adapter_rate > FASTP_ADAPTER_WARN:
+                    metrics['adapter_content'] = 'warn'
                 else:
-                    metrics['overrepresented_sequences'] = 'fail'
+                    metrics['adapter_content'] = 'pass'
             
             # Determine overall status
-            if metrics['per_base_quality'] == 'fail' or metrics['per_sequence_quality'] == 'fail':
-                metrics['status'] = 'fail'
-            elif metrics['per_base_quality'] == 'warn' or metrics['per_sequence_quality'] == 'warn':
-                metrics['status'] = 'warn'
-            else:
-                metrics['status'] = 'pass'
+            metrics['status'] = self._overall_status(metrics)
                 
         except Exception as e:
-            logger.error(f"Error extracting metrics from {fastqc_html}: {e}")
+            logger.error(f"Error extracting metrics from {fastp_report}: {e}")
         
         return metrics
     
@@ -188,6 +526,44 @@ class FastQCQualityControl:
             logger.error(f"Error running MultiQC: {e}")
             return False, str(e)
     
+    @staticmethod
+    @contextmanager
+    def _open_fastq(fastq_file: Path):
+        """Decompressed binary stream of a .fastq.gz, piped from pigz when installed"""
+        if PIGZ is None:
+            with fastq_gzip.open(fastq_file, 'rb') as stream:
+                yield stream
+            return
+        
+        process = subprocess.Popen([PIGZ, '-p', '2', '-dc', str(fastq_file)],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1 << 20)
+        try:
+            yield process.stdout
+        finally:
+            process.stdout.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            returncode = process.wait()
+        
+        # A corrupt or truncated archive surfaces as a pigz exit status, not a read error
+        if returncode != 0:
+            raise OSError(f"pigz failed on {fastq_file.name}: {stderr.decode(errors='replace').strip()}")
+    
+    @staticmethod
+    def _check_line_starts(first_bytes: np.ndarray, first_line_num: int, validation: Dict):
+        """Record header and separator errors from the first byte of consecutive lines"""
+        line_nums = np.arange(first_line_num, first_line_num + len(first_bytes))
+        phase = line_nums % 4
+        bad_header = (phase == 1) & (first_bytes != ord('@'))
+        bad_separator = (phase == 3) & (first_bytes != ord('+'))
+        
+        for line_num in line_nums[bad_header | bad_separator].tolist():
+            if line_num % 4 == 1:
+                validation['errors'].append(f"Line {line_num}: Invalid header (should start with @)")
+            else:
+                validation['errors'].append(f"Line {line_num}: Invalid separator (should start with +)")
+            validation['valid'] = False
+    
     def validate_fastq_format(self, fastq_file: Path) -> Tuple[bool, Dict]:
         """Validate FASTQ file format integrity"""
         logger.info(f"Validating FASTQ format for {fastq_file.name}")
@@ -200,26 +576,34 @@ class FastQCQualityControl:
         }
         
         try:
-            import gzip
-            
-            read_count = 0
-            with gzip.open(fastq_file, 'rt') as f:
-                line_num = 0
-                for line in f:
-                    line_num += 1
+            line_num = 0
+            tail = b''
+            with self._open_fastq(fastq_file) as f:
+                while True:
+                    block = f.read(FASTQ_BLOCK_SIZE)
+                    if not block:
+                        break
+                    
+                    # Check every complete line in the block; the unterminated rest carries over
+                    data = tail + block
+                    view = np.frombuffer(data, dtype=np.uint8)
+                    newlines = np.flatnonzero(view == 0x0A)
+                    if len(newlines) == 0:
+                        tail = data
+                        continue
                     
-                    # FASTQ format: 4 lines per read
-                    if line_num % 4 == 1:
-                        if not line.startswith('@'):
-                            validation['errors'].append(f"Line {line_num}: Invalid header (should start with @)")
-                            validation['valid'] = False
-                    elif line_num % 4 == 3:
-                        if not line.startswith('+'):
-                            validation['errors'].append(f"Line {line_num}: Invalid separator (should start with +)")
-                            validation['valid'] = False
-                    elif line_num % 4 == 0:
-                        read_count += 1
+                    line_starts = np.concatenate(([0], newlines[:-1] + 1))
+                    self._check_line_starts(view[line_starts], line_num + 1, validation)
+                    line_num += len(newlines)
+                    tail = data[newlines[-1] + 1:]
+                
+                # Last line without a trailing newline
+                if tail:
+                    self._check_line_starts(np.frombuffer(tail[:1], dtype=np.uint8), line_num + 1, validation)
+                    line_num += 1
             
+            # FASTQ format: 4 lines per read
+            read_count = line_num // 4
             validation['total_reads'] = read_count
             
             if validation['valid']:
@@ -235,7 +619,7 @@ class FastQCQualityControl:
         return validation['valid'], validation
     
     def process_fastq_file(self, fastq_file: Path) -> Dict:
-        """Process a single FASTQ file"""
+        """Process a single FASTQ file; the caller records the result with _record_result"""
         result = {
             'file': fastq_file.name,
             'path': str(fastq_file),
@@ -250,29 +634,96 @@ class FastQCQualityControl:
         result['validation'] = validation
         
         if not valid:
-            logger.warning(f"Skipping FastQC for invalid file: {fastq_file.name}")
-            self.failed_qc.append(result)
+            logger.warning(f"Skipping {self.QC_TOOLS[self.engine][0]} for invalid file: {fastq_file.name}")
             return result
         
-        # Run FastQC
-        qc_output_dir = self.output_dir / 'fastqc_reports'
-        qc_output_dir.mkdir(parents=True, exist_ok=True)
+        # Run the QC engine (fastp, or FastQC as fallback)
+        qc_output_dir = self.report_dir
         
-        success, message = self.run_fastqc(fastq_file, qc_output_dir)
+        if self.engine == 'fastp':
+            success, message = self.run_fastp(fastq_file, qc_output_dir)
+        else:
+            success, message = self.run_fastqc(fastq_file, qc_output_dir)
         result['fastqc_success'] = success
         result['fastqc_message'] = message
         
         if success:
             # Extract metrics
-            fastqc_html = qc_output_dir / f"{fastq_file.stem}_fastqc.html"
-            if fastqc_html.exists():
-                metrics = self.extract_fastqc_metrics(fastqc_html)
+            qc_report = self._qc_report(fastq_file, qc_output_dir)
+            if qc_report.exists():
+                metrics = self.extract_qc_metrics(qc_report)
                 result['metrics'] = metrics
-        else:
+        
+        return result
+    
+    async def _process_fastq_file_async(self, fastq_file: Path, executor: ProcessPoolExecutor,
+                                        qc_batcher: 'QCBatcher') -> Dict:
+        """process_fastq_file as a pipeline: validation and parsing in the pool, QC tool in a slot"""
+        loop = asyncio.get_running_loop()
+        result = {
+            'file': fastq_file.name,
+            'path': str(fastq_file),
+            'fastqc_success': False,
+            'format_valid': False,
+            'metrics': {}
+        }
+        
+        # Validate format
+        valid, validation = await loop.run_in_executor(executor, self.validate_fastq_format, fastq_file)
+        result['format_valid'] = valid
+        result['validation'] = validation
+        
+        if not valid:
+            logger.warning(f"Skipping {self.QC_TOOLS[self.engine][0]} for invalid file: {fastq_file.name}")
+            return result
+        
+        # Run the QC engine (fastp, or FastQC as fallback)
+        qc_output_dir = self.report_dir
+        
+        success, message = await qc_batcher.run(fastq_file)
+        result['fastqc_success'] = success
+        result['fastqc_message'] = message
+        
+        if success:
+            # Extract metrics
+            qc_report = self._qc_report(fastq_file, qc_output_dir)
+            if qc_report.exists():
+                result['metrics'] = await loop.run_in_executor(executor, self.extract_qc_metrics, qc_report)
+        
+        return result
+    
+    async def _process_all_async(self, fastq_files: List[Path]):
+        """Process every file concurrently and record results as they complete"""
+        # fastp takes one input per process, so only FastQC runs are batched
+        batch_size = FASTQC_BATCH_SIZE if self.engine == 'fastqc' else 1
+        qc_batcher = QCBatcher(self, self.report_dir, asyncio.Semaphore(self.fastqc_concurrency), batch_size)
+        
+        start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=self.max_workers,
+                                 mp_context=mp.get_context(start_method)) as executor:
+            pending = [self._process_fastq_file_async(fastq_file, executor, qc_batcher)
+                       for fastq_file in fastq_files]
+            
+            completed = 0
+            for next_result in asyncio.as_completed(pending):
+                try:
+                    result = await next_result
+                    self._record_result(result)
+                    completed += 1
+                    status = "✓" if result['fastqc_success'] else "✗"
+                    logger.info(f"[{completed}/{len(fastq_files)}] {status} {result['file']}")
+                except Exception as e:
+                    logger.error(f"Error processing file: {e}")
+    
+    def _record_result(self, result: Dict):
+        """Add one processed file to qc_results and/or failed_qc"""
+        if not result['format_valid']:
             self.failed_qc.append(result)
+            return
         
+        if not result['fastqc_success']:
+            self.failed_qc.append(result)
         self.qc_results.append(result)
-        return result
     
     def run_quality_control(self):
         """Execute quality control pipeline"""
@@ -286,28 +737,17 @@ class FastQCQualityControl:
             logger.info("QC pipeline skipped (no input files)")
             return
         
-        logger.info(f"Processing {len(fastq_files)} FASTQ files with {self.max_workers} workers")
+        logger.info(f"Processing {len(fastq_files)} FASTQ files with {self.max_workers} workers, "
+                    f"up to {self.fastqc_concurrency} {self.QC_TOOLS[self.engine][0]} runs at once")
         
-        # Process files in parallel
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = {
-                executor.submit(self.process_fastq_file, fastq_file): fastq_file
-                for fastq_file in fastq_files
-            }
-            
-            completed = 0
-            for future in as_completed(futures):
-                try:
-                    result = future.result()
-                    completed += 1
-                    status = "✓" if result['fastqc_success'] else "✗"
-                    logger.info(f"[{completed}/{len(fastq_files)}] {status} {result['file']}")
-                except Exception as e:
-                    logger.error(f"Error processing file: {e}")
+        # Validation and metric extraction hold the GIL between decompression calls, so
+        # they run in worker processes; QC tool runs are awaited as subprocesses, letting
+        # them overlap with validation of the next files
+        asyncio.run(self._process_all_async(fastq_files))
         
-        # Run MultiQC
-        qc_dir = self.output_dir / 'fastqc_reports'
-        if qc_dir.exists():
+        # Run MultiQC (reads both FastQC and fastp reports) once any report was written
+        qc_dir = self.report_dir
+        if any(qc_dir.iterdir()):
             self.run_multiqc(qc_dir)
         
         logger.info("Quality control pipeline complete!")
@@ -316,26 +756,30 @@ class FastQCQualityControl:
         """Generate QC summary report"""
         logger.info("Generating QC summary report...")
         
-        summary_data = []
-        
-        for result in self.qc_results:
-            summary_row = {
-                'file': result['file'],
-                'format_valid': result['format_valid'],
-                'total_reads': result['validation'].get('total_reads', 0) if result['format_valid'] else 0,
-                'fastqc_success': result['fastqc_success'],
-                'gc_content': result['metrics'].get('gc_content', 0),
-                'sequence_length': result['metrics'].get('sequence_length', ''),
-                'per_base_quality': result['metrics'].get('per_base_quality', 'unknown'),
-                'per_sequence_quality': result['metrics'].get('per_sequence_quality', 'unknown'),
-                'adapter_content': result['metrics'].get('adapter_content', 'unknown'),
-                'overall_status': result['metrics'].get('status', 'unknown')
-            }
-            summary_data.append(summary_row)
+        # One array per column, filled in place rather than transposed from per-file dicts
+        n = len(self.qc_results)
+        files = np.empty(n, dtype=object)
+        format_valid = np.zeros(n, dtype=bool)
+        total_reads = np.zeros(n, dtype=np.int64)
+        fastqc_success = np.zeros(n, dtype=bool)
+        gc_content = np.zeros(n, dtype=np.int64)
+        sequence_length = np.empty(n, dtype=object)
+        statuses = {column: np.empty(n, dtype=object) for column, _ in self.SUMMARY_STATUS_COLUMNS}
+        
+        for i, result in enumerate(self.qc_results):
+            metrics = result['metrics']
+            files[i] = result['file']
+            format_valid[i] = result['format_valid']
+            total_reads[i] = result['validation'].get('total_reads', 0) if result['format_valid'] else 0
+            fastqc_success[i] = result['fastqc_success']
+            gc_content[i] = metrics.get('gc_content', 0)
+            sequence_length[i] = metrics.get('sequence_length', '')
+            for column, key in self.SUMMARY_STATUS_COLUMNS:
+                statuses[column][i] = metrics.get(key, 'unknown')
         
         # Handle empty results - create empty DataFrame with expected columns
-        if not summary_data:
-            summary_data = [{
+        if n == 0:
+            summary_df = pd.DataFrame([{
                 'file': '',
                 'format_valid': False,
                 'total_reads': 0,
@@ -346,10 +790,19 @@ class FastQCQualityControl:
                 'per_sequence_quality': 'unknown',
                 'adapter_content': 'unknown',
                 'overall_status': 'unknown'
-            }]
+            }])
             logger.warning("No QC results available - creating empty summary")
+        else:
+            summary_df = pd.DataFrame({
+                'file': files,
+                'format_valid': format_valid,
+                'total_reads': total_reads,
+                'fastqc_success': fastqc_success,
+                'gc_content': gc_content,
+                'sequence_length': sequence_length,
+                **statuses
+            }, copy=False)
         
-        summary_df = pd.DataFrame(summary_data)
         summary_df.to_csv(self.output_dir / 'qc_summary.csv', index=False)
         logger.info(f"QC summary saved to {self.output_dir / 'qc_summary.csv'}")
         
@@ -381,36 +834,47 @@ class FastQCQualityControl:
                 # Normal report generation
                 f.write(f"Total files processed: {len(summary_df)}\n")
                 
-                # Only access these columns if they exist and DataFrame is not empty
-                if 'format_valid' in summary_df.columns:
-                    f.write(f"Files with valid format: {summary_df['format_valid'].sum()}\n")
-                if 'fastqc_success' in summary_df.columns:
-                    f.write(f"Files with successful FastQC: {summary_df['fastqc_success'].sum()}\n")
-                if 'overall_status' in summary_df.columns:
-                    f.write(f"Files with PASS status: {(summary_df['overall_status'] == 'pass').sum()}\n")
-                    f.write(f"Files with WARN status: {(summary_df['overall_status'] == 'warn').sum()}\n")
-                    f.write(f"Files with FAIL status: {(summary_df['overall_status'] == 'fail').sum()}\n\n")
+                # Only access these columns if they exist and DataFrame is not empty;
+                # each is tallied once and the counts are looked up below
+                columns = summary_df.columns
+                flag_totals = summary_df[[c for c in ('format_valid', 'fastqc_success') if c in columns]].sum()
+                status_counts = {column: summary_df[column].value_counts()
+                                 for column in ('overall_status', 'per_base_quality', 'adapter_content')
+                                 if column in columns}
+                
+                if 'format_valid' in flag_totals:
+                    f.write(f"Files with valid format: {flag_totals['format_valid']}\n")
+                if 'fastqc_success' in flag_totals:
+                    f.write(f"Files with successful FastQC: {flag_totals['fastqc_success']}\n")
+                if 'overall_status' in status_counts:
+                    counts = status_counts['overall_status']
+                    f.write(f"Files with PASS status: {counts.get('pass', 0)}\n")
+                    f.write(f"Files with WARN status: {counts.get('warn', 0)}\n")
+                    f.write(f"Files with FAIL status: {counts.get('fail', 0)}\n\n")
                 
                 f.write("Quality Metrics Summary:\n")
                 f.write("-" * 80 + "\n")
                 
-                if 'gc_content' in summary_df.columns and not summary_df['gc_content'].empty:
+                if 'gc_content' in columns and not summary_df['gc_content'].empty:
                     f.write(f"Average GC content: {summary_df['gc_content'].mean():.1f}%\n")
-                if 'total_reads' in summary_df.columns and not summary_df['total_reads'].empty:
-                    f.write(f"Average read count: {summary_df['total_reads'].mean():.0f}\n")
-                    f.write(f"Median read count: {summary_df['total_reads'].median():.0f}\n\n")
+                if 'total_reads' in columns and not summary_df['total_reads'].empty:
+                    read_stats = summary_df['total_reads'].describe()
+                    f.write(f"Average read count: {read_stats['mean']:.0f}\n")
+                    f.write(f"Median read count: {read_stats['50%']:.0f}\n\n")
                 
                 f.write("Per-Base Quality Distribution:\n")
-                if 'per_base_quality' in summary_df.columns:
-                    f.write(f"  PASS: {(summary_df['per_base_quality'] == 'pass').sum()}\n")
-                    f.write(f"  WARN: {(summary_df['per_base_quality'] == 'warn').sum()}\n")
-                    f.write(f"  FAIL: {(summary_df['per_base_quality'] == 'fail').sum()}\n\n")
+                if 'per_base_quality' in status_counts:
+                    counts = status_counts['per_base_quality']
+                    f.write(f"  PASS: {counts.get('pass', 0)}\n")
+                    f.write(f"  WARN: {counts.get('warn', 0)}\n")
+                    f.write(f"  FAIL: {counts.get('fail', 0)}\n\n")
                 
                 f.write("Adapter Content Distribution:\n")
-                if 'adapter_content' in summary_df.columns:
-                    f.write(f"  PASS: {(summary_df['adapter_content'] == 'pass').sum()}\n")
-                    f.write(f"  WARN: {(summary_df['adapter_content'] == 'warn').sum()}\n")
-                    f.write(f"  FAIL: {(summary_df['adapter_content'] == 'fail').sum()}\n\n")
+                if 'adapter_content' in status_counts:
+                    counts = status_counts['adapter_content']
+                    f.write(f"  PASS: {counts.get('pass', 0)}\n")
+                    f.write(f"  WARN: {counts.get('warn', 0)}\n")
+                    f.write(f"  FAIL: {counts.get('fail', 0)}\n\n")
                 
                 if self.failed_qc:
                     f.write("Failed QC Files:\n")
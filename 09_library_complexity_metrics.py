@@ -5,13 +5,45 @@ Calculates duplication rates, complexity metrics, and library quality indicators
 """
 
 import subprocess
+import os
+import hashlib
 import pandas as pd
+import numpy as np
 import logging
 from pathlib import Path
 from typing import Dict, List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing as mp
 import json
 
+# Prefer ISA-L's igzip (inflate runs in C with the GIL released), else stdlib gzip
+try:
+    from isal import igzip as fastq_gzip
+except ImportError:
+    import gzip as fastq_gzip
+
+# Reads are counted by unsigned 64-bit hash rather than full sequence; xxh3 is fastest,
+# the builtin (SipHash) is stable within one process, which is all we need
+try:
+    import xxhash
+    sequence_hash = xxhash.xxh3_64_intdigest
+except ImportError:
+    def sequence_hash(data: bytes) -> int:
+        return hash(data) & 0xFFFFFFFFFFFFFFFF
+
+# indexed_gzip provides random access into gzip streams, letting one large FASTQ be
+# parsed in parallel ranges
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+# Numba compiles the per-byte GC/quality reduction when installed; NumPy masks otherwise
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -23,20 +55,279 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _span_byte_stats(arr, seq_starts, seq_ends, qual_starts, qual_ends):
+    """GC count and raw quality byte sum over sequence/quality spans, without temporaries"""
+    gc_count = 0
+    for i in range(len(seq_starts)):
+        for j in range(seq_starts[i], seq_ends[i]):
+            base = arr[j] | 0x20
+            if base == 0x67 or base == 0x63:  # 'g' or 'c'
+                gc_count += 1
+    
+    quality_sum = 0
+    for i in range(len(qual_starts)):
+        for j in range(qual_starts[i], qual_ends[i]):
+            quality_sum += int(arr[j])
+    
+    return gc_count, quality_sum
+
+
+span_byte_stats = njit(cache=True, boundscheck=False, nogil=True)(_span_byte_stats) if njit else None
+
+class _RangeReader:
+    """Read-only view of bytes [start, start + length) of a seekable binary stream"""
+    
+    def __init__(self, handle, start: int, length: int):
+        handle.seek(start)
+        self.handle = handle
+        self.remaining = length
+    
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.handle.read(size)
+        self.remaining -= len(data)
+        return data
+
+
 class LibraryComplexityMetrics:
     """Calculate library complexity and duplication metrics"""
     
+    # Report column -> (result section, metric key, default)
+    REPORT_COLUMNS = {
+        'total_reads': ('complexity_metrics', 'total_reads', 0),
+        'unique_sequences': ('complexity_metrics', 'unique_sequences', 0),
+        'duplication_rate': ('complexity_metrics', 'duplication_rate', 0.0),
+        'complexity_score': ('complexity_metrics', 'complexity_score', 0.0),
+        'entropy': ('complexity_metrics', 'entropy', 0.0),
+        'gc_content': ('complexity_metrics', 'gc_content', 0.0),
+        'quality_assessment': ('complexity_metrics', 'quality_assessment', 'unknown'),
+        'chao1_estimate': ('library_size_estimate', 'chao1_estimate', 0.0),
+        'coverage_estimate': ('library_size_estimate', 'coverage_estimate', 0.0)
+    }
+    
     def __init__(self, fastq_dir: str = 'fastq_downloads',
                  output_dir: str = 'complexity_reports',
-                 max_workers: int = 4):
+                 max_workers: int = 4,
+                 sample_reads: int = None,
+                 write_csv: bool = True,
+                 scan_threads: int = 4,
+                 parallel_scan_bytes: int = 1 << 30):
         self.fastq_dir = Path(fastq_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.max_workers = max_workers
-        self.results = []
+        self.sample_reads = sample_reads  # None scans every read
+        self.write_csv = write_csv  # CSV kept for legacy consumers (e.g. master orchestrator)
+        self.scan_threads = scan_threads  # threads per file for indexed parallel scans
+        self.parallel_scan_bytes = parallel_scan_bytes  # compressed size that triggers them
+        self.cache_dir = self.output_dir / '.cache'
+        self.cache_dir.mkdir(exist_ok=True)
+        # Results are kept column-wise (one list per report column), not as nested dicts
+        self.report_columns = {'file': [], **{name: [] for name in self.REPORT_COLUMNS}}
+    
+    @staticmethod
+    def _iter_fastq_blocks(handle, block_size: int = 4 << 20):
+        """Yield (buffer, newline offsets) blocks holding whole 4-line FASTQ records"""
+        carry = b''
+        while True:
+            data = handle.read(block_size)
+            if not data:
+                break
+            
+            buf = carry + data if carry else data
+            newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 0x0A)
+            
+            # Cut after the last complete record; the remainder carries into the next block
+            n_complete = (len(newlines) // 4) * 4
+            if n_complete == 0:
+                carry = buf
+                continue
+            
+            cut = int(newlines[n_complete - 1]) + 1
+            yield buf[:cut], newlines[:n_complete]
+            carry = buf[cut:]
+        
+        if carry:
+            # Final block may lack a trailing newline; treat end of buffer as one
+            newlines = np.flatnonzero(np.frombuffer(carry, dtype=np.uint8) == 0x0A)
+            if carry[-1:] != b'\n':
+                newlines = np.append(newlines, len(carry))
+            yield carry, newlines
+    
+    @staticmethod
+    def _line_spans(arr: np.ndarray, newlines: np.ndarray, offset: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Start/end offsets of every 4th line (offset 1 = sequence, 3 = quality), CR stripped"""
+        n_records = len(newlines) // 4
+        starts = np.concatenate(([0], newlines[:-1] + 1))[offset::4][:n_records]
+        ends = newlines[offset::4][:n_records]
+        
+        # Strip Windows line endings like str.strip() did
+        has_cr = (ends > starts) & (arr[np.maximum(ends - 1, 0)] == 0x0D)
+        return starts, ends - has_cr
+    
+    @staticmethod
+    def _span_mask(size: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Boolean mask selecting the bytes covered by [start, end) spans"""
+        # Spans never overlap, so the running sum stays 0/1 and fits in int8
+        delta = np.zeros(size + 1, dtype=np.int8)
+        delta[starts] += 1
+        delta[ends] -= 1
+        return np.cumsum(delta[:-1], dtype=np.int8).view(bool)
+    
+    @staticmethod
+    def _span_sum(arr: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> int:
+        """Sum of bytes over [start, end) spans with np.add.reduceat (no mask or gathered copy)"""
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+        if not len(starts):
+            return 0
+        
+        # Interleave boundaries; even segments are the spans, odd ones the gaps between
+        bounds = np.empty(2 * len(starts), dtype=np.int64)
+        bounds[0::2] = starts
+        bounds[1::2] = ends
+        if bounds[-1] == len(arr):
+            bounds = bounds[:-1]  # last span runs to the end of the buffer
+        return int(np.add.reduceat(arr, bounds, dtype=np.int64)[0::2].sum())
+    
+    def _scan_stream(self, handle, sample_reads: int = None) -> Dict:
+        """Scan FASTQ records from a binary stream; returns raw read hashes and running totals"""
+        hash_blocks = []
+        total_bases = 0
+        gc_count = 0
+        quality_sum = 0
+        quality_count = 0
+        records_seen = 0
+        
+        # Parse whole blocks of records with NumPy instead of line-by-line Python
+        for buf, newlines in self._iter_fastq_blocks(handle):
+            arr = np.frombuffer(buf, dtype=np.uint8)
+            
+            # FASTQ format: sequence on line 2, quality on line 4
+            seq_starts, seq_ends = self._line_spans(arr, newlines, 1)
+            qual_starts, qual_ends = self._line_spans(arr, newlines, 3)
+            
+            # QC metrics are statistical; stop once the leading sample is reached
+            if sample_reads is not None:
+                remaining = sample_reads - records_seen
+                seq_starts, seq_ends = seq_starts[:remaining], seq_ends[:remaining]
+                qual_starts, qual_ends = qual_starts[:remaining], qual_ends[:remaining]
+            
+            # Only the counts matter downstream, so keep a 64-bit hash of each read.
+            # Case-fold the block once and hash zero-copy views rather than
+            # allocating an upper-cased copy of every read
+            folded = memoryview(buf.upper())
+            hash_blocks.append(np.fromiter(
+                (sequence_hash(folded[start:end])
+                 for start, end in zip(seq_starts.tolist(), seq_ends.tolist())),
+                dtype=np.uint64, count=len(seq_starts)
+            ))
+            
+            total_bases += int((seq_ends - seq_starts).sum())
+            block_quality_count = int((qual_ends - qual_starts).sum())
+            
+            # Count GC (case-insensitive: OR 0x20 lowercases ASCII letters)
+            if span_byte_stats is not None:
+                block_gc, block_quality_sum = span_byte_stats(arr, seq_starts, seq_ends,
+                                                              qual_starts, qual_ends)
+            else:
+                seq_bytes = arr[self._span_mask(len(arr), seq_starts, seq_ends)] | 0x20
+                block_gc = np.count_nonzero((seq_bytes == ord('g')) | (seq_bytes == ord('c')))
+                block_quality_sum = self._span_sum(arr, qual_starts, qual_ends)
+            
+            gc_count += int(block_gc)
+            quality_sum += int(block_quality_sum) - 33 * block_quality_count
+            quality_count += block_quality_count
+            
+            records_seen += len(seq_starts)
+            if sample_reads is not None and records_seen >= sample_reads:
+                break
+        
+        return {
+            'hashes': np.concatenate(hash_blocks) if hash_blocks else np.zeros(0, dtype=np.uint64),
+            'total_bases': total_bases,
+            'gc_count': gc_count,
+            'quality_sum': quality_sum,
+            'quality_count': quality_count
+        }
+    
+    @staticmethod
+    def _align_to_record(handle, offset: int, window: int = 1 << 20) -> int:
+        """Offset of the first FASTQ record starting at or after `offset` in the uncompressed stream"""
+        if offset == 0:
+            return 0
+        
+        # Start one byte early so a record beginning exactly at `offset` is found
+        handle.seek(offset - 1)
+        lines = handle.read(window).split(b'\n')
+        pos = offset + len(lines[0])
+        
+        # '@' alone is ambiguous (quality lines may start with it); require '+' two lines
+        # later and matching sequence/quality lengths
+        for i in range(1, len(lines) - 4):
+            if (lines[i][:1] == b'@' and lines[i + 2][:1] == b'+'
+                    and len(lines[i + 1].rstrip(b'\r')) == len(lines[i + 3].rstrip(b'\r'))):
+                return pos
+            pos += len(lines[i]) + 1
+        
+        raise ValueError(f"No FASTQ record boundary found near offset {offset}")
+    
+    def _scan_parallel(self, fastq_file: Path) -> List[Dict]:
+        """Scan disjoint record-aligned ranges of one large gzip FASTQ on several threads"""
+        index_file = self._cache_path(fastq_file).with_suffix('.gzi')
+        
+        # Build the seek-point index once and persist it; later runs just import it
+        with indexed_gzip.IndexedGzipFile(str(fastq_file)) as f:
+            if index_file.exists():
+                f.import_index(str(index_file))
+            else:
+                f.build_full_index()
+                f.export_index(str(index_file))
+            
+            uncompressed_size = f.seek(0, os.SEEK_END)
+            step = uncompressed_size // self.scan_threads
+            bounds = sorted({self._align_to_record(f, i * step) for i in range(self.scan_threads)})
+            bounds.append(uncompressed_size)
+        
+        def scan_range(start: int, end: int) -> Dict:
+            with indexed_gzip.IndexedGzipFile(str(fastq_file), index_file=str(index_file)) as f:
+                return self._scan_stream(_RangeReader(f, start, end - start))
+        
+        logger.info(f"Scanning {fastq_file.name} in {len(bounds) - 1} parallel ranges")
+        with ThreadPoolExecutor(max_workers=len(bounds) - 1) as executor:
+            return list(executor.map(scan_range, bounds[:-1], bounds[1:]))
+    
+    def _scan_fastq(self, fastq_file: Path) -> Dict:
+        """Single pass over a FASTQ file collecting everything both metric sets need"""
+        # Large files with no read cap are split across threads via a gzip index
+        if (indexed_gzip is not None and self.sample_reads is None and self.scan_threads > 1
+                and fastq_file.stat().st_size >= self.parallel_scan_bytes):
+            parts = self._scan_parallel(fastq_file)
+        else:
+            with fastq_gzip.open(fastq_file, 'rb') as f:
+                parts = [self._scan_stream(f, self.sample_reads)]
+        
+        # Per-sequence read counts in one sort instead of a dict update per read
+        _, sequence_counts = np.unique(np.concatenate([part['hashes'] for part in parts]),
+                                       return_counts=True)
+        
+        return {
+            'sequence_counts': sequence_counts,
+            'total_bases': sum(part['total_bases'] for part in parts),
+            'gc_count': sum(part['gc_count'] for part in parts),
+            'quality_sum': sum(part['quality_sum'] for part in parts),
+            'quality_count': sum(part['quality_count'] for part in parts)
+        }
+    
+    @staticmethod
+    def _empty_scan() -> Dict:
+        """Scan result used when a file cannot be read"""
+        return {'sequence_counts': np.zeros(0, dtype=np.int64), 'total_bases': 0, 'gc_count': 0,
+                'quality_sum': 0, 'quality_count': 0}
     
-    def calculate_sequence_complexity(self, fastq_file: Path) -> Dict:
-        """Calculate sequence complexity metrics"""
+    def calculate_sequence_complexity(self, fastq_file: Path, scan: Dict = None) -> Dict:
+        """Calculate sequence complexity metrics (reuses `scan` from _scan_fastq if given)"""
         logger.info(f"Calculating complexity for {fastq_file.name}")
         
         result_dict = {
@@ -52,36 +343,14 @@ class LibraryComplexityMetrics:
         }
         
         try:
-            import gzip
-            from collections import Counter
-            import math
-            
-            sequence_counts = Counter()
-            total_bases = 0
-            gc_count = 0
-            quality_scores = []
-            
-            with gzip.open(fastq_file, 'rt') as f:
-                line_num = 0
-                for line in f:
-                    line_num += 1
-                    
-                    # FASTQ format: sequence on line 2, quality on line 4
-                    if line_num % 4 == 2:
-                        sequence = line.strip().upper()
-                        sequence_counts[sequence] += 1
-                        
-                        # Count GC
-                        gc_count += sequence.count('G') + sequence.count('C')
-                        total_bases += len(sequence)
-                        
-                    elif line_num % 4 == 0:
-                        quality = line.strip()
-                        quality_scores.extend([ord(q) - 33 for q in quality])
+            if scan is None:
+                scan = self._scan_fastq(fastq_file)
+            counts = scan['sequence_counts']
+            total_bases = scan['total_bases']
             
             # Calculate metrics
-            total_reads = sum(sequence_counts.values())
-            unique_sequences = len(sequence_counts)
+            total_reads = int(counts.sum())
+            unique_sequences = len(counts)
             duplicate_reads = total_reads - unique_sequences
             
             result_dict['total_reads'] = total_reads
@@ -98,20 +367,17 @@ class LibraryComplexityMetrics:
             
             # Shannon entropy (measure of sequence diversity)
             if total_reads > 0:
-                entropy = 0.0
-                for count in sequence_counts.values():
-                    p = count / total_reads
-                    if p > 0:
-                        entropy -= p * math.log2(p)
-                result_dict['entropy'] = entropy
+                # -sum(p log p) == log N - sum(c log c) / N; no per-element division
+                result_dict['entropy'] = float(np.log2(total_reads)
+                                               - np.dot(counts, np.log2(counts)) / total_reads)
             
             # GC content
             if total_bases > 0:
-                result_dict['gc_content'] = (gc_count / total_bases) * 100
+                result_dict['gc_content'] = (scan['gc_count'] / total_bases) * 100
             
             # Quality assessment
-            if quality_scores:
-                mean_quality = sum(quality_scores) / len(quality_scores)
+            if scan['quality_count']:
+                mean_quality = scan['quality_sum'] / scan['quality_count']
                 if mean_quality >= 30:
                     result_dict['quality_assessment'] = 'high'
                 elif mean_quality >= 20:
@@ -126,8 +392,8 @@ class LibraryComplexityMetrics:
         
         return result_dict
     
-    def estimate_library_size(self, fastq_file: Path) -> Dict:
-        """Estimate library size using Chao1 estimator"""
+    def estimate_library_size(self, fastq_file: Path, scan: Dict = None) -> Dict:
+        """Estimate library size using Chao1 estimator (reuses `scan` from _scan_fastq if given)"""
         logger.info(f"Estimating library size for {fastq_file.name}")
         
         result_dict = {
@@ -140,26 +406,16 @@ class LibraryComplexityMetrics:
         }
         
         try:
-            import gzip
-            from collections import Counter
+            if scan is None:
+                scan = self._scan_fastq(fastq_file)
+            counts = scan['sequence_counts']
             
-            sequence_counts = Counter()
+            # Frequency of frequencies; Chao1 only needs f1 and f2
+            freq_of_freq = np.bincount(counts, minlength=3)
             
-            with gzip.open(fastq_file, 'rt') as f:
-                line_num = 0
-                for line in f:
-                    line_num += 1
-                    
-                    if line_num % 4 == 2:
-                        sequence = line.strip().upper()
-                        sequence_counts[sequence] += 1
-            
-            # Count species by frequency
-            frequency_counts = Counter(sequence_counts.values())
-            
-            observed_species = len(sequence_counts)
-            singleton_species = frequency_counts.get(1, 0)
-            doubleton_species = frequency_counts.get(2, 0)
+            observed_species = len(counts)
+            singleton_species = int(freq_of_freq[1])
+            doubleton_species = int(freq_of_freq[2])
             
             result_dict['observed_species'] = observed_species
             result_dict['singleton_species'] = singleton_species
@@ -174,7 +430,7 @@ class LibraryComplexityMetrics:
             result_dict['chao1_estimate'] = chao1
             
             # Coverage estimate (Good's coverage)
-            total_reads = sum(sequence_counts.values())
+            total_reads = int(counts.sum())
             if total_reads > 0:
                 coverage = 1 - (singleton_species / total_reads)
                 result_dict['coverage_estimate'] = coverage * 100
@@ -186,15 +442,47 @@ class LibraryComplexityMetrics:
         
         return result_dict
     
+    def _iter_fastq(self):
+        """Yield FASTQ paths as strings, walking the tree with os.scandir (no per-entry Path/stat)"""
+        stack = [str(self.fastq_dir)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith('.fastq.gz') and entry.is_file():
+                            yield entry.path
+            except OSError as e:
+                logger.warning(f"Cannot scan directory: {e}")
+    
     def find_fastq_files(self) -> List[Path]:
         """Find all FASTQ files"""
         logger.info(f"Searching for FASTQ files in {self.fastq_dir}")
-        fastq_files = list(self.fastq_dir.rglob('*.fastq.gz'))
+        fastq_files = [Path(path) for path in self._iter_fastq()]
         logger.info(f"Found {len(fastq_files)} FASTQ files")
         return fastq_files
     
+    def _cache_path(self, fastq_file: Path) -> Path:
+        """Cache file for a FASTQ, keyed on path, mtime, size and sample size"""
+        stat = fastq_file.stat()
+        key = hashlib.sha1(
+            f"{fastq_file.resolve()}|{stat.st_mtime_ns}|{stat.st_size}|{self.sample_reads}".encode()
+        ).hexdigest()
+        return self.cache_dir / f"{key}.json"
+    
     def process_sample(self, fastq_file: Path) -> Dict:
-        """Process a single sample"""
+        """Process a single sample, reusing the cached result if the file is unchanged"""
+        cache_file = self._cache_path(fastq_file)
+        if cache_file.exists():
+            try:
+                with open(cache_file) as f:
+                    result = json.load(f)
+                logger.info(f"Using cached metrics for {fastq_file.name}")
+                return result
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache for {fastq_file.name}: {e}")
+        
         result = {
             'file': fastq_file.name,
             'path': str(fastq_file),
@@ -202,17 +490,42 @@ class LibraryComplexityMetrics:
             'library_size_estimate': {}
         }
         
+        # Read the file once; both metric sets are derived from the same scan
+        scanned = False
+        try:
+            scan = self._scan_fastq(fastq_file)
+            scanned = True
+        except Exception as e:
+            logger.error(f"Error reading {fastq_file.name}: {e}")
+            scan = self._empty_scan()
+        
         # Calculate complexity
-        complexity = self.calculate_sequence_complexity(fastq_file)
+        complexity = self.calculate_sequence_complexity(fastq_file, scan)
         result['complexity_metrics'] = complexity
         
         # Estimate library size
-        library_size = self.estimate_library_size(fastq_file)
+        library_size = self.estimate_library_size(fastq_file, scan)
         result['library_size_estimate'] = library_size
         
-        self.results.append(result)
+        # Only cache successful scans so unreadable files are retried next run
+        if scanned:
+            tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp_file, cache_file)
+        
         return result
     
+    def _process_batch(self, fastq_files: List[Path]) -> List[Dict]:
+        """Process several files in one worker task; a failing file does not drop the rest"""
+        results = []
+        for fastq_file in fastq_files:
+            try:
+                results.append(self.process_sample(fastq_file))
+            except Exception as e:
+                logger.error(f"Error processing {fastq_file.name}: {e}")
+        return results
+    
     def run_complexity_analysis(self):
         """Execute library complexity analysis pipeline"""
         logger.info("Starting library complexity analysis pipeline...")
@@ -225,49 +538,53 @@ class LibraryComplexityMetrics:
         
         logger.info(f"Processing {len(fastq_files)} files with {self.max_workers} workers")
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+        # Per-read hashing and per-block Python work hold the GIL, so run each file in its
+        # own process; results come back through the futures and are collected here
+        start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=self.max_workers,
+                                 mp_context=mp.get_context(start_method)) as executor:
+            # Batch files per task to amortize dispatch for many small files, while
+            # keeping at least ~4 tasks per worker so large files still balance
+            batch_size = max(1, min(16, len(fastq_files) // (self.max_workers * 4)))
             futures = {
-                executor.submit(self.process_sample, fastq_file): fastq_file
-                for fastq_file in fastq_files
+                executor.submit(self._process_batch, fastq_files[i:i + batch_size]): i
+                for i in range(0, len(fastq_files), batch_size)
             }
             
             completed = 0
             for future in as_completed(futures):
                 try:
-                    result = future.result()
-                    completed += 1
-                    logger.info(f"[{completed}/{len(fastq_files)}] ✓ {result['file']}")
+                    for result in future.result():
+                        self._record_result(result)
+                        completed += 1
+                        logger.info(f"[{completed}/{len(fastq_files)}] ✓ {result['file']}")
                 except Exception as e:
-                    logger.error(f"Error processing file: {e}")
+                    logger.error(f"Error processing batch: {e}")
         
         logger.info("Library complexity analysis complete!")
     
+    def _record_result(self, result: Dict):
+        """Append one processed sample to the report columns"""
+        self.report_columns['file'].append(result['file'])
+        for name, (section, key, default) in self.REPORT_COLUMNS.items():
+            self.report_columns[name].append(result[section].get(key, default))
+    
+    def _save_report(self, report_df: pd.DataFrame, stem: str):
+        """Write a report as Snappy Parquet, plus CSV when write_csv is set"""
+        try:
+            report_df.to_parquet(self.output_dir / f'{stem}.parquet', compression='snappy', index=False)
+        except ImportError:
+            logger.warning(f"No Parquet engine (pyarrow) installed, skipping {stem}.parquet")
+        
+        if self.write_csv:
+            report_df.to_csv(self.output_dir / f'{stem}.csv', index=False)
+    
     def generate_complexity_report(self) -> pd.DataFrame:
         """Generate library complexity report"""
         logger.info("Generating library complexity report...")
         
-        report_data = []
-        
-        for result in self.results:
-            complexity = result['complexity_metrics']
-            library = result['library_size_estimate']
-            
-            report_row = {
-                'file': result['file'],
-                'total_reads': complexity.get('total_reads', 0),
-                'unique_sequences': complexity.get('unique_sequences', 0),
-                'duplication_rate': complexity.get('duplication_rate', 0.0),
-                'complexity_score': complexity.get('complexity_score', 0.0),
-                'entropy': complexity.get('entropy', 0.0),
-                'gc_content': complexity.get('gc_content', 0.0),
-                'quality_assessment': complexity.get('quality_assessment', 'unknown'),
-                'chao1_estimate': library.get('chao1_estimate', 0.0),
-                'coverage_estimate': library.get('coverage_estimate', 0.0)
-            }
-            report_data.append(report_row)
-        
-        report_df = pd.DataFrame(report_data)
-        report_df.to_csv(self.output_dir / 'library_complexity_report.csv', index=False)
+        report_df = pd.DataFrame(self.report_columns)
+        self._save_report(report_df, 'library_complexity_report')
         logger.info("Library complexity report saved")
         
         return report_df
@@ -278,6 +595,15 @@ class LibraryComplexityMetrics:
         
         summary_file = self.output_dir / 'LIBRARY_COMPLEXITY_SUMMARY.txt'
         
+        # One fused aggregation over all numeric columns instead of a scan per statistic
+        stats = report_df[['total_reads', 'duplication_rate', 'complexity_score', 'entropy',
+                           'gc_content', 'chao1_estimate', 'coverage_estimate']].agg(
+            ['mean', 'median', 'min', 'max', 'std'])
+        
+        # Duplication buckets (<5, 5-10, >=10) in a single pass
+        dup_buckets = np.bincount(np.digitize(report_df['duplication_rate'].to_numpy(), [5, 10]),
+                                  minlength=3)
+        
         with open(summary_file, 'w') as f:
             f.write("=" * 80 + "\n")
             f.write("LIBRARY COMPLEXITY METRICS REPORT\n")
@@ -286,36 +612,36 @@ class LibraryComplexityMetrics:
             f.write(f"Total samples analyzed: {len(report_df)}\n\n")
             
             f.write("Read Statistics:\n")
-            f.write(f"  Total reads (mean): {report_df['total_reads'].mean():.0f}\n")
-            f.write(f"  Total reads (median): {report_df['total_reads'].median():.0f}\n")
-            f.write(f"  Total reads (range): [{report_df['total_reads'].min():.0f}, {report_df['total_reads'].max():.0f}]\n\n")
+            f.write(f"  Total reads (mean): {stats.at['mean', 'total_reads']:.0f}\n")
+            f.write(f"  Total reads (median): {stats.at['median', 'total_reads']:.0f}\n")
+            f.write(f"  Total reads (range): [{stats.at['min', 'total_reads']:.0f}, {stats.at['max', 'total_reads']:.0f}]\n\n")
             
             f.write("Duplication Metrics:\n")
-            f.write(f"  Mean duplication rate: {report_df['duplication_rate'].mean():.1f}%\n")
-            f.write(f"  Median duplication rate: {report_df['duplication_rate'].median():.1f}%\n")
-            f.write(f"  Samples with <5% duplication: {(report_df['duplication_rate'] < 5).sum()}\n")
-            f.write(f"  Samples with 5-10% duplication: {((report_df['duplication_rate'] >= 5) & (report_df['duplication_rate'] < 10)).sum()}\n")
-            f.write(f"  Samples with >10% duplication: {(report_df['duplication_rate'] >= 10).sum()}\n\n")
+            f.write(f"  Mean duplication rate: {stats.at['mean', 'duplication_rate']:.1f}%\n")
+            f.write(f"  Median duplication rate: {stats.at['median', 'duplication_rate']:.1f}%\n")
+            f.write(f"  Samples with <5% duplication: {dup_buckets[0]}\n")
+            f.write(f"  Samples with 5-10% duplication: {dup_buckets[1]}\n")
+            f.write(f"  Samples with >10% duplication: {dup_buckets[2]}\n\n")
             
             f.write("Complexity Metrics:\n")
-            f.write(f"  Mean complexity score: {report_df['complexity_score'].mean():.1f}%\n")
-            f.write(f"  Median complexity score: {report_df['complexity_score'].median():.1f}%\n")
-            f.write(f"  Mean entropy: {report_df['entropy'].mean():.2f}\n")
-            f.write(f"  Median entropy: {report_df['entropy'].median():.2f}\n\n")
+            f.write(f"  Mean complexity score: {stats.at['mean', 'complexity_score']:.1f}%\n")
+            f.write(f"  Median complexity score: {stats.at['median', 'complexity_score']:.1f}%\n")
+            f.write(f"  Mean entropy: {stats.at['mean', 'entropy']:.2f}\n")
+            f.write(f"  Median entropy: {stats.at['median', 'entropy']:.2f}\n\n")
             
             f.write("GC Content:\n")
-            f.write(f"  Mean GC%: {report_df['gc_content'].mean():.1f}%\n")
-            f.write(f"  Median GC%: {report_df['gc_content'].median():.1f}%\n")
-            f.write(f"  Std Dev: {report_df['gc_content'].std():.1f}%\n\n")
+            f.write(f"  Mean GC%: {stats.at['mean', 'gc_content']:.1f}%\n")
+            f.write(f"  Median GC%: {stats.at['median', 'gc_content']:.1f}%\n")
+            f.write(f"  Std Dev: {stats.at['std', 'gc_content']:.1f}%\n\n")
             
             f.write("Library Size Estimates (Chao1):\n")
-            f.write(f"  Mean: {report_df['chao1_estimate'].mean():.0f}\n")
-            f.write(f"  Median: {report_df['chao1_estimate'].median():.0f}\n")
-            f.write(f"  Range: [{report_df['chao1_estimate'].min():.0f}, {report_df['chao1_estimate'].max():.0f}]\n\n")
+            f.write(f"  Mean: {stats.at['mean', 'chao1_estimate']:.0f}\n")
+            f.write(f"  Median: {stats.at['median', 'chao1_estimate']:.0f}\n")
+            f.write(f"  Range: [{stats.at['min', 'chao1_estimate']:.0f}, {stats.at['max', 'chao1_estimate']:.0f}]\n\n")
             
             f.write("Coverage Estimates:\n")
-            f.write(f"  Mean coverage: {report_df['coverage_estimate'].mean():.1f}%\n")
-            f.write(f"  Median coverage: {report_df['coverage_estimate'].median():.1f}%\n\n")
+            f.write(f"  Mean coverage: {stats.at['mean', 'coverage_estimate']:.1f}%\n")
+            f.write(f"  Median coverage: {stats.at['median', 'coverage_estimate']:.1f}%\n\n")
             
             f.write("Quality Assessment Distribution:\n")
             quality_counts = report_df['quality_assessment'].value_counts()
@@ -329,33 +655,27 @@ class LibraryComplexityMetrics:
         """Generate quality flags for each sample"""
         logger.info("Generating quality flags...")
         
-        flags = []
+        duplication = report_df['duplication_rate'].to_numpy()
+        gc_content = report_df['gc_content'].to_numpy()
         
-        for idx, row in report_df.iterrows():
-            sample_flags = []
-            
-            # Check duplication rate
-            if row['duplication_rate'] > 20:
-                sample_flags.append('HIGH_DUPLICATION')
-            elif row['duplication_rate'] > 10:
-                sample_flags.append('MODERATE_DUPLICATION')
-            
-            # Check complexity
-            if row['complexity_score'] < 50:
-                sample_flags.append('LOW_COMPLEXITY')
-            
-            # Check GC content (should be ~50% for human)
-            if row['gc_content'] < 40 or row['gc_content'] > 60:
-                sample_flags.append('ABNORMAL_GC_CONTENT')
-            
-            # Check coverage
-            if row['coverage_estimate'] < 80:
-                sample_flags.append('LOW_COVERAGE')
-            
-            flags.append('|'.join(sample_flags) if sample_flags else 'PASS')
+        # Each check as a boolean column, in the order flags are listed
+        checks = [
+            ('HIGH_DUPLICATION', duplication > 20),
+            ('MODERATE_DUPLICATION', (duplication > 10) & ~(duplication > 20)),
+            ('LOW_COMPLEXITY', report_df['complexity_score'].to_numpy() < 50),
+            # GC content should be ~50% for human
+            ('ABNORMAL_GC_CONTENT', (gc_content < 40) | (gc_content > 60)),
+            ('LOW_COVERAGE', report_df['coverage_estimate'].to_numpy() < 80)
+        ]
+        
+        flags = np.full(len(report_df), '', dtype=object)
+        for name, mask in checks:
+            flags = np.where(mask, flags + (name + '|'), flags)
+        
+        flags = [flag.rstrip('|') or 'PASS' for flag in flags]
         
         report_df['quality_flags'] = flags
-        report_df.to_csv(self.output_dir / 'library_complexity_with_flags.csv', index=False)
+        self._save_report(report_df, 'library_complexity_with_flags')
         
         logger.info("Quality flags generated")
         return report_df
@@ -368,7 +688,8 @@ def main():
     metrics = LibraryComplexityMetrics(
         fastq_dir='fastq_downloads',
         output_dir='complexity_reports',
-        max_workers=4
+        max_workers=4,
+        sample_reads=2_000_000
     )
     
     # Run analysis
@@ -30,6 +30,19 @@ else:
     import logging
     logging.getLogger(__name__).warning("NCBI API key not set - using standard rate limit (3 req/sec). Performance will be slower.")
 
+# Eutils request rate shared by all worker threads (NCBI allows 3/s without a key, 10/s with one)
+NCBI_REQUESTS_PER_SECOND = float(os.getenv("NCBI_REQUESTS_PER_SECOND", "10" if NCBI_API_KEY else "3"))
+NCBI_RATE_BURST = int(os.getenv("NCBI_RATE_BURST", "1"))  # requests allowed back-to-back after idle time
+NCBI_MAX_CONCURRENCY = int(os.getenv("NCBI_MAX_CONCURRENCY", "8"))
+NCBI_BATCH_SIZE = int(os.getenv("NCBI_BATCH_SIZE", "200"))  # IDs per esummary/efetch request
+NCBI_CACHE_EXPIRE_SECONDS = int(os.getenv("NCBI_CACHE_EXPIRE_SECONDS", "86400"))  # 0 disables the response cache
+NCBI_HTTP2 = os.getenv("NCBI_HTTP2", "false").lower() == "true"  # multiplex eutils over HTTP/2 (needs httpx[http2]; bypasses the cache)
+
+# ENA portal API request rate shared by all worker threads (ENA allows up to 50/s)
+ENA_REQUESTS_PER_SECOND = float(os.getenv("ENA_REQUESTS_PER_SECOND", "10"))
+ENA_MAX_CONCURRENCY = int(os.getenv("ENA_MAX_CONCURRENCY", "8"))
+ENA_CACHE_EXPIRE_SECONDS = int(os.getenv("ENA_CACHE_EXPIRE_SECONDS", "86400"))  # 0 disables the response cache
+
 
 # ===== DATABASE PATHS =====
 KRAKEN2_DB_PATH = os.getenv(
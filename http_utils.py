@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP helpers for the query and download scripts
+Token-bucket rate limiting and throttled keep-alive sessions with an optional on-disk cache,
+including the session shared by the NCBI E-utilities query engines
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Optional on-disk cache for API responses
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+# Optional HTTP/2 client for eutils (pip install "httpx[http2]")
+try:
+    import httpx
+    HTTP_ERRORS = (requests.RequestException, httpx.HTTPError)
+except ImportError:
+    httpx = None
+    HTTP_ERRORS = (requests.RequestException,)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how often requests may start"""
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a token is available, then consume it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                wait_time = (1 - self._tokens) / self.rate
+            
+            time.sleep(wait_time)
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """HTTPAdapter that waits for a rate-limit slot before every real network send"""
+    
+    def __init__(self, throttle: Callable[[], None], **kwargs):
+        self._throttle = throttle
+        super().__init__(**kwargs)
+    
+    def send(self, request, **kwargs):
+        self._throttle()
+        return super().send(request, **kwargs)
+
+
+def build_session(throttle: Callable[[], None],
+                  cache_name: Optional[str] = None,
+                  expire_seconds: int = 0,
+                  allowable_methods: Sequence[str] = ('GET',),
+                  ignored_parameters: Optional[Sequence[str]] = None,
+                  pool_connections: int = 10,
+                  pool_maxsize: int = 10,
+                  max_retries: int = 0) -> requests.Session:
+    """
+    Build a keep-alive session throttled at the adapter.
+    
+    Args:
+        throttle: Called before every network send, e.g. TokenBucket.acquire
+        cache_name: SQLite cache path; responses are cached when requests-cache is
+            installed and expire_seconds is positive
+        expire_seconds: Cache lifetime
+        allowable_methods: HTTP methods whose responses are cached
+        ignored_parameters: Request parameters left out of the cache key (e.g. credentials)
+        pool_connections: Connection pools kept by the adapter
+        pool_maxsize: Connections kept per pool
+        max_retries: Adapter-level retries
+    
+    Returns:
+        requests.Session, or requests_cache.CachedSession when caching is enabled
+    """
+    if requests_cache is not None and cache_name and expire_seconds > 0:
+        cache_options = {'ignored_parameters': list(ignored_parameters)} if ignored_parameters else {}
+        # Repeat runs and retries are answered from disk
+        session = requests_cache.CachedSession(
+            cache_name=cache_name,
+            backend='sqlite',
+            allowable_methods=tuple(allowable_methods),
+            expire_after=timedelta(seconds=expire_seconds),
+            stale_if_error=True,
+            **cache_options
+        )
+    else:
+        session = requests.Session()
+    
+    # Throttle at the adapter so cache hits never wait for a rate-limit slot
+    session.mount('https://', ThrottledAdapter(throttle, pool_connections=pool_connections,
+                                               pool_maxsize=pool_maxsize, max_retries=max_retries))
+    return session
+
+
+def _build_http2_client(params: Dict[str, str], timeout: float, throttle: Callable[[], None],
+                        max_connections: int) -> Optional['httpx.Client']:
+    """httpx client multiplexing concurrent requests over one HTTP/2 connection"""
+    if httpx is None:
+        logger.warning("HTTP/2 requested but httpx is not installed - using HTTP/1.1 session")
+        return None
+    
+    try:
+        # The request hook takes a rate-limit slot before anything is sent;
+        # no response cache on this path
+        return httpx.Client(
+            http2=True,
+            params=params,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections),
+            event_hooks={'request': [lambda request: throttle()]}
+        )
+    except ImportError:
+        logger.warning("HTTP/2 requested but the h2 package is missing - using HTTP/1.1 session")
+        return None
+
+
+def build_eutils_session(email: str, api_key: Optional[str], timeout: float,
+                         throttle: Callable[[], None],
+                         cache_name: Optional[str] = None,
+                         expire_seconds: int = 0,
+                         http2: bool = False,
+                         max_connections: int = 10):
+    """
+    Build the session NCBI E-utilities requests go through; retries stay with the caller.
+    
+    Args:
+        email: Contact address sent with every request
+        api_key: NCBI API key sent with every request, if set
+        timeout: Request timeout of the HTTP/2 client (requests sessions take it per call)
+        throttle: Called before every network send, e.g. TokenBucket.acquire
+        cache_name: SQLite cache path for the HTTP/1.1 session
+        expire_seconds: Cache lifetime (0 disables the cache)
+        http2: Multiplex requests over HTTP/2 with httpx when it is installed
+        max_connections: Connection limit of the HTTP/2 client
+    
+    Returns:
+        httpx.Client when http2 is set and available, else a (cached) requests session
+    """
+    params = {'email': email}
+    if api_key:
+        params['api_key'] = api_key
+    
+    if http2:
+        client = _build_http2_client(params, timeout, throttle, max_connections)
+        if client is not None:
+            return client
+    
+    session = build_session(
+        throttle,
+        # POST bodies (batched IDs) are part of the cache key, credentials are not
+        cache_name=cache_name,
+        expire_seconds=expire_seconds,
+        allowable_methods=('GET', 'POST'),
+        ignored_parameters=['api_key', 'email'],
+        pool_connections=16,
+        pool_maxsize=64
+    )
+    session.params = params
+    return session
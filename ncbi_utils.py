@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Shared base for the NCBI E-utilities query engines (GEO and SRA)
+Metadata checkpointing between runs, per-cancer-type querying with cross-cancer deduplication
+and streaming of the results to CSV
+"""
+
+import logging
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+import config
+from http_utils import HTTP_ERRORS as NCBI_HTTP_ERRORS
+
+# Native multithreaded CSV writer for large result tables
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    # Raised by Table.from_pandas when a frame cannot be converted or cast to a schema
+    ARROW_CAST_ERRORS = (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError)
+except ImportError:
+    pacsv = None
+
+
+class NCBIQueryEngine:
+    """
+    Metadata cache and cancer-type iteration shared by the GEO and SRA query engines.
+    
+    Subclasses provide METADATA_KEYS, OUTPUT_FILE, _search_ids, _fetch_batch_safe and
+    filter_bulk_rnaseq.
+    """
+    
+    # Record noun used in log messages, e.g. 'dataset' or 'experiment'
+    RECORD_NAME = 'record'
+    # Output columns, in order
+    METADATA_KEYS: Tuple[str, ...] = ()
+    # Fetched columns that _build_frame turns into output columns
+    EXTRA_KEYS: Tuple[str, ...] = ()
+    # Default results file under config.DATA_DIR
+    OUTPUT_FILE = 'results.csv'
+    # Columns of every saved row returned by stream_results for the run summary
+    SUMMARY_COLUMNS: Tuple[str, ...] = ('cancer_type',)
+    
+    def __init__(self, metadata_cache_file: Path, logger: logging.Logger):
+        """
+        Args:
+            metadata_cache_file: Pickle checkpoint of fetched metadata
+            logger: Logger of the engine's script, so messages land in its log file
+        """
+        self.logger = logger
+        # In-process metadata by ID; checkpointed to disk by main()
+        self._metadata_cache: Dict[str, Dict] = {}
+        self._metadata_cache_since = time.time()
+        self.metadata_cache_file = metadata_cache_file
+    
+    def load_metadata_cache(self):
+        """Reuse metadata checkpointed by an earlier run, unless older than NCBI_CACHE_EXPIRE_SECONDS"""
+        if config.NCBI_CACHE_EXPIRE_SECONDS <= 0:
+            return
+        try:
+            with open(self.metadata_cache_file, 'rb') as handle:
+                saved = pickle.load(handle)
+        except FileNotFoundError:
+            return
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            self.logger.warning(f"Ignoring unreadable metadata cache {self.metadata_cache_file}: {e}")
+            return
+        
+        if time.time() - saved.get('saved_at', 0) > config.NCBI_CACHE_EXPIRE_SECONDS:
+            self.logger.info(f"Metadata cache {self.metadata_cache_file} has expired - refetching")
+            return
+        # Keep the original timestamp so re-saving never extends the expiry
+        self._metadata_cache.update(saved['metadata'])
+        self._metadata_cache_since = min(self._metadata_cache_since, saved['saved_at'])
+        self.logger.info(f"Loaded {len(saved['metadata'])} cached {self.RECORD_NAME} records "
+                         f"from {self.metadata_cache_file}")
+    
+    def save_metadata_cache(self):
+        """Checkpoint fetched metadata for the next run"""
+        if config.NCBI_CACHE_EXPIRE_SECONDS <= 0 or not self._metadata_cache:
+            return
+        tmp_file = self.metadata_cache_file.with_suffix('.tmp')
+        try:
+            self.metadata_cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_file, 'wb') as handle:
+                pickle.dump({'saved_at': self._metadata_cache_since, 'metadata': dict(self._metadata_cache)},
+                            handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.metadata_cache_file)
+        except OSError as e:
+            self.logger.warning(f"Could not save metadata cache {self.metadata_cache_file}: {e}")
+    
+    def _search_ids(self, cancer_type: str, max_results: int) -> List[str]:
+        """IDs esearch returns for one cancer type"""
+        raise NotImplementedError
+    
+    def _fetch_batch_safe(self, ids: List[str]) -> List[Optional[Dict]]:
+        """Metadata for one batch of IDs, in input order (None where the fetch failed)"""
+        raise NotImplementedError
+    
+    def _build_frame(self, columns: Dict[str, list]) -> pd.DataFrame:
+        """DataFrame of one cancer type's rows from the columnar accumulator"""
+        return pd.DataFrame(columns, copy=False)
+    
+    def _fetch_unique_metadata(self, ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """Fetch metadata once per unique ID, keyed by ID (None where the fetch failed)"""
+        # IDs already fetched by this process (or loaded from the checkpoint) skip the network
+        cached = {id_: self._metadata_cache[id_] for id_ in ids if id_ in self._metadata_cache}
+        ids = [id_ for id_ in ids if id_ not in cached]
+        
+        # One request per NCBI_BATCH_SIZE IDs, batches fetched concurrently;
+        # the engine's rate limiter keeps the workers under NCBI's rate limit
+        batches = [ids[i:i + config.NCBI_BATCH_SIZE]
+                   for i in range(0, len(ids), config.NCBI_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=config.NCBI_MAX_CONCURRENCY) as executor:
+            results = [metadata for batch in executor.map(self._fetch_batch_safe, batches)
+                       for metadata in batch]
+        results = dict(zip(ids, results))
+        self._metadata_cache.update((id_, metadata) for id_, metadata in results.items() if metadata)
+        results.update(cached)
+        return results
+    
+    def iter_cancer_results(self, max_results_per_cancer: int = 50) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """
+        Query all cancer types, yielding each one's records as soon as its metadata is in.
+        
+        Args:
+            max_results_per_cancer: Maximum results to retrieve per cancer type
+        
+        Yields:
+            (cancer_type, DataFrame) in config order; cancer types without records are skipped
+        """
+        cancer_types = list(config.CANCER_TYPES.keys())
+        failed_queries = []
+        
+        # Searches run concurrently; the shared rate limiter bounds the combined request rate
+        ids_by_cancer = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(config.NCBI_MAX_CONCURRENCY, len(cancer_types)))) as executor:
+            futures = {cancer_type: executor.submit(self._search_ids, cancer_type, max_results_per_cancer)
+                       for cancer_type in cancer_types}
+            
+            for cancer_type, future in futures.items():
+                try:
+                    ids_by_cancer[cancer_type] = future.result()
+                    self.logger.info(f"Processing {len(ids_by_cancer[cancer_type])} results for {cancer_type}")
+                except NCBI_HTTP_ERRORS as e:
+                    self.logger.error(f"Failed to query cancer type {cancer_type}: {e}")
+                    failed_queries.append((cancer_type, str(e)))
+                except Exception as e:
+                    self.logger.error(f"Unexpected error querying {cancer_type}: {e}")
+                    failed_queries.append((cancer_type, str(e)))
+        
+        if failed_queries:
+            self.logger.warning(f"Failed to query {len(failed_queries)} cancer types: {failed_queries}")
+        
+        # Pan-cancer studies come back for several cancer types; each ID is fetched once,
+        # by the first cancer type that found it
+        seen = set()
+        new_ids_by_cancer = {}
+        for cancer_type, ids in ids_by_cancer.items():
+            new_ids_by_cancer[cancer_type] = [id_ for id_ in dict.fromkeys(ids) if id_ not in seen]
+            seen.update(new_ids_by_cancer[cancer_type])
+        self.logger.info(f"Fetching metadata for {len(seen)} unique {self.RECORD_NAME}s")
+        
+        metadata_by_id = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(config.NCBI_MAX_CONCURRENCY, len(cancer_types)))) as executor:
+            futures = {cancer_type: executor.submit(self._fetch_unique_metadata, ids)
+                       for cancer_type, ids in new_ids_by_cancer.items()}
+            
+            # Collected in cancer type order, so IDs shared with an earlier cancer type are already in
+            for cancer_type, ids in ids_by_cancer.items():
+                metadata_by_id.update(futures[cancer_type].result())
+                
+                # Columnar accumulator: one list per output column instead of a dict per row
+                columns = {key: [] for key in self.METADATA_KEYS + self.EXTRA_KEYS}
+                for id_ in ids:
+                    metadata = metadata_by_id.get(id_)
+                    if metadata is not None:
+                        for key, column in columns.items():
+                            column.append(cancer_type if key == 'cancer_type' else metadata.get(key))
+                if columns['cancer_type']:
+                    yield cancer_type, self._build_frame(columns)
+    
+    def filter_bulk_rnaseq(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Rows of one cancer type that are bulk RNA-seq"""
+        raise NotImplementedError
+    
+    def stream_results(self, max_results_per_cancer: int = 50, output_file: Optional[str] = None) -> pd.DataFrame:
+        """
+        Query, filter and append each cancer type's records to CSV as soon as they are fetched.
+        
+        Only one cancer type's rows are held as a DataFrame at a time, and an interrupted
+        run leaves the cancer types finished so far on disk.
+        
+        Args:
+            max_results_per_cancer: Maximum results to retrieve per cancer type
+            output_file: Output file path (config.DATA_DIR / OUTPUT_FILE if not specified)
+        
+        Returns:
+            SUMMARY_COLUMNS of every saved row, for the run summary
+        """
+        if output_file is None:
+            output_file = str(config.DATA_DIR / self.OUTPUT_FILE)
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        
+        summaries = []
+        writer = schema = None
+        handle = None
+        try:
+            for cancer_type, df in self.iter_cancer_results(max_results_per_cancer):
+                df = self.filter_bulk_rnaseq(df)
+                if df.empty:
+                    continue
+                
+                if handle is None:
+                    handle = open(output_file, 'wb')
+                
+                table = None
+                if pacsv is not None:
+                    try:
+                        # Later cancer types are cast to the first one's schema
+                        table = pa.Table.from_pandas(df, preserve_index=False, schema=schema)
+                    except ARROW_CAST_ERRORS as e:
+                        # e.g. a column typed null because it was empty for the first cancer
+                        # type; these rows are written by pandas instead of aborting the run
+                        self.logger.debug(f"Arrow CSV writer rejected {cancer_type} rows, using pandas: {e}")
+                
+                # Both writers append to the same handle; the header comes from whichever writes first
+                if table is not None:
+                    if writer is None:
+                        schema = table.schema
+                        writer = pacsv.CSVWriter(handle, schema,
+                                                 write_options=pacsv.WriteOptions(include_header=handle.tell() == 0))
+                    writer.write_table(table)
+                else:
+                    handle.write(df.to_csv(index=False, header=handle.tell() == 0).encode())
+                handle.flush()
+                
+                summaries.append(df[list(self.SUMMARY_COLUMNS)])
+                self.logger.info(f"Saved {len(df)} {self.RECORD_NAME}s for {cancer_type} to {output_file}")
+        finally:
+            if writer is not None:
+                writer.close()
+            if handle is not None:
+                handle.close()
+        
+        if not summaries:
+            return pd.DataFrame()
+        return pd.concat(summaries, ignore_index=True)